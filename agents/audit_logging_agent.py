@@ -4,8 +4,7 @@ Maintains comprehensive audit trail for compliance and traceability.
 """
 
 import asyncio
-import json
-from typing import Dict, Any
+from typing import Dict, Any, List
 from datetime import datetime
 import logging
 import os
@@ -17,6 +16,8 @@ from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 # Import our plugins
 from plugins.cosmos_db_plugin import CosmosDBPlugin
 from plugins.service_bus_plugin import ServiceBusPlugin
+from utils.batching import AsyncBatchWriter, spill_to_jsonl
+from models.audit_record import AuditRecord
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +29,7 @@ class AuditLoggingAgent:
     - Listens for 'audit_event' messages from any agent.
     - Parses the audit data.
     - Stores the audit data in the 'AuditLogs' container in Cosmos DB.
+      Entries are queued and written in batches by a background flusher.
     - Handles storage errors gracefully.
     """
     
@@ -39,6 +41,21 @@ class AuditLoggingAgent:
         self.cosmos_plugin = None
         self.servicebus_plugin = None
 
+        # Audit entries are buffered and written to Cosmos DB in batches
+        self._audit_writer = AsyncBatchWriter(
+            self._write_audit_batch,
+            name=self.agent_name,
+            batch_size=100,
+            flush_interval=0.2,
+            max_queue_size=10_000
+        )
+
+        # Alerts raised from the flusher run in the background; tracked so close() can await them
+        self._background_tasks = set()
+
+        # Records that could not be written to Cosmos DB are appended here for replay
+        self._spill_path = os.path.join("logs", f"{self.session_id}_unwritten.jsonl")
+
         self._initialized = False
 
     async def _initialize_kernel(self):
@@ -68,68 +85,80 @@ class AuditLoggingAgent:
             self.kernel.add_plugin(self.cosmos_plugin, plugin_name="cosmos_db")
             self.kernel.add_plugin(self.servicebus_plugin, plugin_name="service_bus")
 
+            self._audit_writer.start()
+
             self._initialized = True
-            logger.info(f"{self.agent_name}: Semantic Kernel initialized successfully")
+            logger.info("%s: Semantic Kernel initialized successfully", self.agent_name)
 
         except Exception as e:
-            logger.error(f"{self.agent_name}: Failed to initialize Semantic Kernel - {str(e)}")
+            logger.error("%s: Failed to initialize Semantic Kernel - %s", self.agent_name, e)
             raise
 
     async def handle_message(self, message: Dict[str, Any]):
         """Handles a single audit message from the service bus."""
-        await self._initialize_kernel()
+        if not self._initialized:
+            await self._initialize_kernel()
 
         message_type = message.get('message_type')
 
         if message_type != 'audit_event':
-            logger.warning(f"Received unexpected message type: {message_type}. Skipping.")
+            logger.warning("Received unexpected message type: %s. Skipping.", message_type)
             return
 
-        try:
-            agent_name = message.get('agent_name')
-            action = message.get('action')
-            loan_application_id = message.get('loan_application_id')
-            audit_data = message.get('audit_data', {})
-
-            logger.info(f"Processing audit event from '{agent_name}' for action '{action}' on loan '{loan_application_id}'")
-
-            # Prepare the audit record for Cosmos DB
-            # The plugin function expects a single JSON string as its payload.
-            audit_payload = {
-                "agent_name": agent_name,
-                "action": action,
-                "loan_application_id": loan_application_id,
-                "details": audit_data,
-                "outcome": "SUCCESS" # Assume success unless an error occurs during logging
-            }
-
-            # Call the CosmosDB plugin to create the audit log
-            result_str = await self.cosmos_plugin.create_audit_log(json.dumps(audit_payload))
-            result = json.loads(result_str)
-
-            if not result.get("success"):
-                # If logging to Cosmos fails, we have a critical problem.
-                # We'll log it to the console and send an exception alert.
-                error_msg = f"CRITICAL: Failed to write audit log to Cosmos DB. Details: {result.get('error')}"
-                logger.error(error_msg)
-                # This could create a feedback loop if the exception bus is also down, but it's a risk worth taking.
-                await self._send_exception_alert(
-                    "LOGGING_FAILURE", 
-                    "critical", 
-                    error_msg, 
-                    loan_application_id
-                )
-
-        except Exception as e:
-            error_msg = f"Error processing audit message: {str(e)}"
+        agent_name = message.get('agent_name')
+        action = message.get('action')
+        loan_application_id = message.get('loan_application_id')
+
+        # Normalize up front so nothing past this point on the hot path is expected to raise;
+        # storage failures are reported by the flusher. Incomplete events are still part of the
+        # trail, so they are stored as 'Unknown' (as AuditRecord.from_dict does) rather than dropped.
+        if not agent_name or not action:
+            logger.warning("Audit event missing agent_name or action for loan '%s'. Storing as 'Unknown'.", loan_application_id)
+            agent_name = agent_name or 'Unknown'
+            action = action or 'Unknown'
+
+        logger.info("Processing audit event from '%s' for action '%s' on loan '%s'", agent_name, action, loan_application_id)
+
+        # Slotted record: only the fields the Cosmos layer stores, without per-entry dict overhead
+        record = AuditRecord(
+            agent_name=agent_name,
+            action=action,
+            loan_application_id=loan_application_id,
+            details=message.get('audit_data') or {},
+            outcome=message.get('outcome', 'SUCCESS'), # Assume success unless an error occurs during logging
+            timestamp=message.get('timestamp')
+        )
+
+        # Hand the record to the background flusher and return without waiting on Cosmos DB.
+        # Only when the queue is full do we wait, which applies backpressure to the listener.
+        if not self._audit_writer.put_nowait(record):
+            logger.warning("%s: Audit queue full, waiting for the flusher to catch up", self.agent_name)
+            await self._audit_writer.put(record)
+
+    async def _write_audit_batch(self, audit_entries: List[AuditRecord]):
+        """Writes a batch of queued audit entries to Cosmos DB."""
+        result = await self.cosmos_plugin.create_audit_logs_batch(audit_entries)
+
+        if not result.get("success"):
+            # If logging to Cosmos fails, we have a critical problem.
+            # We'll log it to the console and send an exception alert.
+            failed_entries = result.get("failed", [])
+            spilled = await spill_to_jsonl(self._spill_path, failed_entries)
+            error_msg = (f"CRITICAL: Failed to write {len(failed_entries)} of {len(audit_entries)} audit logs to Cosmos DB. "
+                         f"Details: {result.get('error')}. "
+                         f"{'Saved to ' + self._spill_path if spilled else 'Records could not be saved locally'}")
             logger.error(error_msg)
-            # Send an alert about the failure to process the audit message itself.
-            await self._send_exception_alert(
-                "TECHNICAL_ERROR", 
-                "high", 
-                error_msg, 
-                message.get('loan_application_id', 'unknown')
-            )
+            # This could create a feedback loop if the exception bus is also down, but it's a risk worth taking.
+            # Don't hold up the next batch on the Service Bus round-trip.
+            loan_ids = {record.loan_application_id for record in failed_entries}
+            alert_task = asyncio.create_task(self._send_exception_alert(
+                "LOGGING_FAILURE",
+                "critical",
+                error_msg,
+                loan_ids.pop() if len(loan_ids) == 1 else "multiple"
+            ))
+            self._background_tasks.add(alert_task)
+            alert_task.add_done_callback(self._background_tasks.discard)
 
     async def _send_exception_alert(self, exception_type: str, priority: str, message: str, loan_application_id: str):
         """Sends an alert about a failure, in this case, a failure to log."""
@@ -143,14 +172,18 @@ class AuditLoggingAgent:
                 exception_type=exception_type,
                 priority=priority,
                 loan_application_id=loan_application_id,
-                exception_data=json.dumps(exception_data)
+                exception_data=exception_data
             )
         except Exception as e:
             # If this fails, we can't do much else but log to console.
-            logger.critical(f"FATAL: Could not send exception alert about logging failure. Error: {str(e)}")
+            logger.critical("FATAL: Could not send exception alert about logging failure. Error: %s", e)
 
     async def close(self):
         if self._initialized:
+            # Flush queued audit entries before the Cosmos client goes away
+            await self._audit_writer.aclose()
+            if self._background_tasks:
+                await asyncio.gather(*self._background_tasks, return_exceptions=True)
             if self.cosmos_plugin: await self.cosmos_plugin.close()
             if self.servicebus_plugin: await self.servicebus_plugin.close()
-        logger.info(f"{self.agent_name}: Resources cleaned up.")
\ No newline at end of file
+        logger.info("%s: Resources cleaned up.", self.agent_name)
\ No newline at end of file
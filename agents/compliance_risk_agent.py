@@ -4,7 +4,8 @@ Ensures rate lock requests comply with internal and regulatory guidelines.
 """
 
 import asyncio
-import json
+import functools
+import orjson
 from typing import Dict, Any
 from datetime import datetime
 import logging
@@ -21,6 +22,20 @@ from plugins.compliance_plugin import CompliancePlugin
 
 logger = logging.getLogger(__name__)
 
+
+def _log_send_failure(what: str):
+    """Logs (with traceback) and swallows failures of a best-effort Service Bus send."""
+    def decorator(send):
+        @functools.wraps(send)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await send(*args, **kwargs)
+            except Exception:
+                logger.exception("Failed to send %s", what)
+        return wrapper
+    return decorator
+
+
 class ComplianceRiskAgent:
     """
     Role: Ensures the lock request complies with internal and regulatory guidelines.
@@ -73,43 +88,57 @@ class ComplianceRiskAgent:
             self.kernel.add_plugin(self.compliance_plugin, plugin_name="compliance")
             
             self._initialized = True
-            logger.info(f"{self.agent_name}: Semantic Kernel initialized successfully")
+            logger.info("%s: Semantic Kernel initialized successfully", self.agent_name)
             
         except Exception as e:
-            logger.error(f"{self.agent_name}: Failed to initialize Semantic Kernel - {str(e)}")
+            logger.error("%s: Failed to initialize Semantic Kernel - %s", self.agent_name, e)
             raise
 
     async def handle_message(self, message: Dict[str, Any]):
         """Handles a single message from the service bus."""
-        await self._initialize_kernel()
+        if not self._initialized:
+            await self._initialize_kernel()
         
         message_type = message.get('message_type')
         loan_application_id = message.get('loan_application_id')
         
-        logger.info(f"{self.agent_name}: Received message '{message_type}' for loan '{loan_application_id}'")
+        logger.info("%s: Received message '%s' for loan '%s'", self.agent_name, message_type, loan_application_id)
 
         if message_type != 'rates_presented':
-            logger.warning(f"Received unexpected message type: {message_type}. Skipping.")
+            logger.warning("Received unexpected message type: %s. Skipping.", message_type)
             return
 
         try:
             # 1. Fetch the full loan record from Cosmos DB
             rate_lock_record_str = await self.cosmos_plugin.get_rate_lock(loan_application_id)
-            rate_lock_record = json.loads(rate_lock_record_str)
+            rate_lock_record = orjson.loads(rate_lock_record_str)
 
             if not rate_lock_record.get("success"):
                 raise ValueError(f"Could not retrieve rate lock record for {loan_application_id}")
 
             loan_data = rate_lock_record.get("data", {})
 
-            # 2. Run compliance assessment
-            compliance_result_str = await self.compliance_plugin.run_compliance_assessment(json.dumps(loan_data))
-            compliance_result = json.loads(compliance_result_str)
+            # 2. Run compliance assessment. A loan the LOS already marked ineligible fails
+            # regardless of the checks, so skip the compliance service round-trip for it
+            los_data = loan_data.get("los_data") or {}
+            if los_data.get("is_eligible_for_lock") is False:
+                logger.info("Loan '%s' is not eligible for a rate lock; skipping compliance checks.", loan_application_id)
+                compliance_data = {
+                    "overall_status": "Failed",
+                    "checks": {},
+                    "failed_checks": ["loan_eligibility"],
+                    "short_circuited": True,
+                    "details": los_data.get("reason_for_ineligibility", "Loan is not eligible for a rate lock.")
+                }
+            else:
+                compliance_result_str = await self.compliance_plugin.run_compliance_assessment(orjson.dumps(loan_data).decode())
+                compliance_result = orjson.loads(compliance_result_str)
 
-            if not compliance_result.get("success"):
-                raise ValueError(f"Compliance assessment failed: {compliance_result.get('error')}")
+                if not compliance_result.get("success"):
+                    raise ValueError(f"Compliance assessment failed: {compliance_result.get('error')}")
+
+                compliance_data = compliance_result.get("data", {})
 
-            compliance_data = compliance_result.get("data", {})
             compliance_status = compliance_data.get("overall_status", "Failed")
 
             # 3. Determine new status and update Cosmos DB
@@ -119,27 +148,27 @@ class ComplianceRiskAgent:
                 "compliance_check_results": compliance_data,
                 "compliance_checked_at": datetime.utcnow().isoformat()
             }
-            await self.cosmos_plugin.update_rate_lock(loan_application_id, json.dumps(update_payload))
+            await self.cosmos_plugin.update_rate_lock(loan_application_id, orjson.dumps(update_payload).decode())
             
-            # 4. Send audit message
-            await self._send_audit_message("COMPLIANCE_CHECKED", loan_application_id, {
+            # 4 & 5. Send the audit message and the next-step message together; both only
+            # depend on the record update above, not on each other
+            audit_send = self._send_audit_message("COMPLIANCE_CHECKED", loan_application_id, {
                 "status": new_status,
                 "compliance_status": compliance_status
             })
             
-            # 5. Send workflow message for the next agent
             if compliance_status == "Passed":
-                await self._send_workflow_message("compliance_passed", loan_application_id, {
+                await asyncio.gather(audit_send, self._send_workflow_message("compliance_passed", loan_application_id, {
                     "loan_application_id": loan_application_id,
                     "next_action": "present_for_confirmation"
-                })
-                logger.info(f"Compliance check PASSED for loan '{loan_application_id}'.")
+                }))
+                logger.info("Compliance check PASSED for loan '%s'.", loan_application_id)
             else:
                 # If compliance fails, we might send an alert or trigger a manual review
-                await self._send_exception_alert("COMPLIANCE_FAILURE", "medium", 
+                await asyncio.gather(audit_send, self._send_exception_alert("COMPLIANCE_FAILURE", "medium", 
                                                  f"Compliance check failed for loan {loan_application_id}", 
-                                                 loan_application_id)
-                logger.warning(f"Compliance check FAILED for loan '{loan_application_id}'.")
+                                                 loan_application_id))
+                logger.warning("Compliance check FAILED for loan '%s'.", loan_application_id)
 
 
         except Exception as e:
@@ -147,47 +176,41 @@ class ComplianceRiskAgent:
             logger.error(error_msg)
             await self._send_exception_alert("TECHNICAL_ERROR", "high", error_msg, loan_application_id)
 
+    @_log_send_failure("audit message")
     async def _send_audit_message(self, action: str, loan_application_id: str, audit_data: Dict[str, Any]):
-        try:
-            await self.servicebus_plugin.send_audit_message(
-                agent_name=self.agent_name,
-                action=action,
-                loan_application_id=loan_application_id,
-                audit_data=json.dumps(audit_data)
-            )
-        except Exception as e:
-            logger.error(f"Failed to send audit message: {str(e)}")
-
+        await self.servicebus_plugin.send_audit_message(
+            agent_name=self.agent_name,
+            action=action,
+            loan_application_id=loan_application_id,
+            audit_data=audit_data
+        )
+
+    @_log_send_failure("workflow message")
     async def _send_workflow_message(self, message_type: str, loan_application_id: str, message_data: Dict[str, Any]):
-        try:
-            await self.servicebus_plugin.send_workflow_message(
-                message_type=message_type,
-                loan_application_id=loan_application_id,
-                message_data=json.dumps(message_data),
-                correlation_id=self.session_id
-            )
-        except Exception as e:
-            logger.error(f"Failed to send workflow message: {str(e)}")
-
+        await self.servicebus_plugin.send_workflow_message(
+            message_type=message_type,
+            loan_application_id=loan_application_id,
+            message_data=orjson.dumps(message_data).decode(),
+            correlation_id=self.session_id
+        )
+
+    @_log_send_failure("exception alert")
     async def _send_exception_alert(self, exception_type: str, priority: str, message: str, loan_application_id: str):
-        try:
-            exception_data = {
-                "agent": self.agent_name,
-                "error_message": message,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            await self.servicebus_plugin.send_exception_alert(
-                exception_type=exception_type,
-                priority=priority,
-                loan_application_id=loan_application_id,
-                exception_data=json.dumps(exception_data)
-            )
-        except Exception as e:
-            logger.error(f"Failed to send exception alert: {str(e)}")
+        exception_data = {
+            "agent": self.agent_name,
+            "error_message": message,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        await self.servicebus_plugin.send_exception_alert(
+            exception_type=exception_type,
+            priority=priority,
+            loan_application_id=loan_application_id,
+            exception_data=exception_data
+        )
 
     async def close(self):
         if self._initialized:
             if self.cosmos_plugin: await self.cosmos_plugin.close()
             if self.servicebus_plugin: await self.servicebus_plugin.close()
             if self.compliance_plugin: await self.compliance_plugin.close()
-        logger.info(f"{self.agent_name}: Resources cleaned up.")
\ No newline at end of file
+        logger.info("%s: Resources cleaned up.", self.agent_name)
\ No newline at end of file
@@ -4,11 +4,16 @@ Parses loan lock requests from Service Bus messages (originating from a Logic Ap
 """
 
 import asyncio
-import json
-from typing import Optional, Dict, Any
+import hashlib
+import itertools
+import orjson
+from collections import OrderedDict
+from typing import Any, Dict, Optional
 from datetime import datetime
 import logging
 import os
+import re
+import time
 
 # Semantic Kernel imports
 from semantic_kernel import Kernel
@@ -18,9 +23,49 @@ from semantic_kernel.functions import kernel_function
 # Import our plugins
 from plugins.cosmos_db_plugin import CosmosDBPlugin
 from plugins.service_bus_plugin import ServiceBusPlugin
+from utils.batching import AsyncBatchWriter, spill_to_jsonl
 
 logger = logging.getLogger(__name__)
 
+# Compiled once at import; these run against every inbound email
+_FROM_HEADER_RE = re.compile(r'From:\s*([^\n\r]+)', re.IGNORECASE)
+_SUBJECT_HEADER_RE = re.compile(r'Subject:\s*([^\n\r]+)', re.IGNORECASE)
+
+# Common patterns for loan IDs, in priority order
+_LOAN_ID_PATTERNS = (
+    re.compile(r'loan[:\s]+([A-Z0-9-]{6,20})', re.IGNORECASE),
+    re.compile(r'application[:\s]+([A-Z0-9-]{6,20})', re.IGNORECASE),
+    re.compile(r'loan[:\s]*id[:\s]*([A-Z0-9-]{6,20})', re.IGNORECASE),
+    re.compile(r'([A-Z]{2,4}\d{6,12})', re.IGNORECASE),  # Pattern like ABC123456789
+    re.compile(r'(\d{10,15})', re.IGNORECASE),  # Simple numeric IDs
+)
+
+# Field patterns for the non-AI fallback extraction
+_FALLBACK_LOAN_ID_RE = re.compile(r'LA\d{5,}', re.IGNORECASE)
+_LOCK_PERIOD_RE = re.compile(r'(\d+)\s*day', re.IGNORECASE)
+_SIGNATURE_NAME_RE = re.compile(r'(Best regards|Thanks|Sincerely),?\s*([A-Z][a-z]+\s+[A-Z][a-z]+)')
+_STREET_ADDRESS_RE = re.compile(r'(\d+\s+[A-Za-z\s]+(?:St|Ave|Rd|Blvd|Dr)[^.]*)')
+
+# Rate lock ids for inbox records: a per-process prefix plus a counter, so ids stay unique
+# and ordered without formatting the current time for every record
+_RATE_LOCK_ID_PREFIX = f"RL{int(time.time())}"
+_rate_lock_id_counter = itertools.count(1)
+
+# Borrower acknowledgment email, rendered with str.format for each processed request
+_ACK_SUBJECT_TMPL = "Rate Lock Request Received for Loan: {loan_id}"
+_ACK_BODY_TMPL = """
+        Dear {borrower_name},
+
+        Thank you for submitting your rate lock request for loan application {loan_id}.
+
+        We have received your request for a {lock_period_days}-day lock period. Our system is now gathering the required information from the Loan Origination System.
+
+        You will receive a separate email with your personalized rate quotes shortly.
+
+        Thank you,
+        The Automated Rate Lock System
+        """
+
 class EmailIntakeAgent:
     """
     Role: AI-powered intake for loan lock requests from Service Bus.
@@ -34,6 +79,13 @@ class EmailIntakeAgent:
     - Sends a message to the outbound email topic to send an acknowledgment.
     """
     
+    # Concurrent workers draining the inbox, and how many messages may wait for them
+    INBOX_WORKERS = 4
+    INBOX_QUEUE_SIZE = 64
+    
+    # LLM extraction results kept for repeated email content (least recently used evicted first)
+    EXTRACTION_CACHE_SIZE = 1024
+    
     def __init__(self):
         self.agent_name = "email_intake_agent"
         self.session_id = f"intake_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -41,6 +93,22 @@ class EmailIntakeAgent:
         self.kernel = None
         self.cosmos_plugin = None
         self.servicebus_plugin = None
+        self._openai_credential = None
+        self._extract_fn = None  # email_parser.extract_loan_data_from_email, resolved once at init
+        
+        # Audit events are queued and sent to Service Bus in batches by a background flusher
+        self._audit_sender = AsyncBatchWriter(
+            self._send_audit_batch,
+            name=f"{self.agent_name}_audit",
+            batch_size=100,
+            flush_interval=0.02
+        )
+        
+        # Audit events that could not be sent to Service Bus are appended here for replay
+        self._spill_path = os.path.join("logs", f"{self.session_id}_unsent_audit.jsonl")
+        
+        # Content digest -> extracted data, so a re-delivered or duplicate email skips the LLM call
+        self._extraction_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
         
         self._initialized = False
 
@@ -56,8 +124,8 @@ class EmailIntakeAgent:
             deployment_name = os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
             
             # EXPLICIT LOGGING - NO HIDING CONFIGURATION ISSUES
-            logger.info(f"{self.agent_name}: 🔧 Azure OpenAI Endpoint: {endpoint}")
-            logger.info(f"{self.agent_name}: 🔧 Deployment Name: {deployment_name}")
+            logger.info("%s: 🔧 Azure OpenAI Endpoint: %s", self.agent_name, endpoint)
+            logger.info("%s: 🔧 Deployment Name: %s", self.agent_name, deployment_name)
             
             if not all([endpoint, deployment_name]):
                 raise ValueError(f"Missing Azure OpenAI configuration: endpoint={endpoint}, deployment={deployment_name}")
@@ -65,8 +133,11 @@ class EmailIntakeAgent:
             # Use managed identity for Azure OpenAI authentication
             from azure.identity.aio import DefaultAzureCredential
             
+            # One credential for the agent's lifetime: it caches the access token and only goes
+            # back to Entra ID near expiry, instead of running the credential chain on every LLM call
+            self._openai_credential = credential = DefaultAzureCredential()
+            
             async def get_token():
-                credential = DefaultAzureCredential()
                 token = await credential.get_token("https://cognitiveservices.azure.com/.default")
                 return token.token
 
@@ -87,55 +158,64 @@ class EmailIntakeAgent:
             self.kernel.add_plugin(self.servicebus_plugin, plugin_name="service_bus")
             # Note: No need to register self as email_parser plugin since we call LLM directly
             
+            # Resolve the extraction function once instead of looking it up on every email;
+            # stays None unless an email_parser plugin has been registered
+            email_parser = self.kernel.plugins.get("email_parser")
+            self._extract_fn = email_parser.functions.get("extract_loan_data_from_email") if email_parser else None
+            
+            self._audit_sender.start()
+            
             self._initialized = True
-            logger.info(f"{self.agent_name}: Semantic Kernel initialized successfully")
+            logger.info("%s: Semantic Kernel initialized successfully", self.agent_name)
             
         except Exception as e:
-            logger.error(f"{self.agent_name}: Failed to initialize Semantic Kernel - {str(e)}")
+            logger.error("%s: Failed to initialize Semantic Kernel - %s", self.agent_name, e)
             raise
 
     async def handle_message(self, message: str):
         """Handles a single message from the service bus."""
-        await self._initialize_kernel()
+        if not self._initialized:
+            await self._initialize_kernel()
         
         # Enhanced logging for debugging
-        logger.info(f"{self.agent_name}: 🎯 HANDLING NEW MESSAGE")
-        logger.info(f"{self.agent_name}: 📏 Message length: {len(message) if message else 0} characters")
-        logger.info(f"{self.agent_name}: 📋 Message type: {type(message)}")
+        logger.info("%s: 🎯 HANDLING NEW MESSAGE", self.agent_name)
+        logger.info("%s: 📏 Message length: %s characters", self.agent_name, len(message) if message else 0)
+        logger.info("%s: 📋 Message type: %s", self.agent_name, type(message))
         
         try:
             # All messages are raw text that need LLM parsing
             if message and message.strip():
-                logger.info(f"{self.agent_name}: ✅ Message validation passed - proceeding with LLM processing")
+                logger.info("%s: ✅ Message validation passed - proceeding with LLM processing", self.agent_name)
                 await self._process_raw_email_with_llm(message)
             else:
-                logger.warning(f"{self.agent_name}: ❌ Received empty message")
+                logger.warning("%s: ❌ Received empty message", self.agent_name)
                 
         except Exception as e:
             error_msg = f"Failed to process message: {str(e)}"
-            logger.error(f"{self.agent_name}: 🚨 {error_msg}")
+            logger.error("%s: 🚨 %s", self.agent_name, error_msg)
             await self._send_exception_alert("TECHNICAL_ERROR", "high", error_msg, "unknown")
 
     async def _process_raw_email_with_llm(self, raw_email_content: str):
         """Process raw email content using LLM for intelligent parsing."""
-        logger.info(f"{self.agent_name}: Processing raw email content with LLM")
+        logger.info("%s: Processing raw email content with LLM", self.agent_name)
         
         # Log the raw input message for debugging
-        logger.info(f"{self.agent_name}: 📨 RAW INPUT MESSAGE:")
-        logger.info(f"{self.agent_name}: {'-'*50}")
-        logger.info(f"{self.agent_name}: {raw_email_content[:500]}{'...' if len(raw_email_content) > 500 else ''}")
-        logger.info(f"{self.agent_name}: {'-'*50}")
+        logger.info("%s: 📨 RAW INPUT MESSAGE:", self.agent_name)
+        logger.info("%s: --------------------------------------------------", self.agent_name)
+        logger.info("%s: %.500s%s", self.agent_name, raw_email_content, '...' if len(raw_email_content) > 500 else '')
+        logger.info("%s: --------------------------------------------------", self.agent_name)
         
         try:
             # Call Azure OpenAI directly to parse the email content
             extracted_data = await self._extract_loan_data_with_llm(raw_email_content)
             
             loan_application_id = extracted_data.get('loan_application_id')
-            if not loan_application_id or loan_application_id in [None, "", "null"]:
+            # None and "" are already falsy; the LLM may also spell a missing value as the string "null"
+            if not loan_application_id or loan_application_id == "null":
                 logger.warning("LLM could not extract loan application ID from email content, but this should not happen with improved extraction")
                 return
                 
-            logger.info(f"{self.agent_name}: LLM successfully extracted loan ID: {loan_application_id}")
+            logger.info("%s: LLM successfully extracted loan ID: %s", self.agent_name, loan_application_id)
             
             # Extract email metadata from raw content for audit trail
             from_address = self._extract_email_address(raw_email_content)
@@ -151,30 +231,37 @@ class EmailIntakeAgent:
                 "raw_email_content": raw_email_content[:1000]  # First 1000 chars for audit
             }
             
-            # Store in Cosmos DB using the correct method and parameters
-            await self.cosmos_plugin.create_rate_lock(
+            # Store in Cosmos DB using the correct method and parameters, and send to the
+            # next agent in the workflow once the record exists
+            create_result = await self.cosmos_plugin.create_rate_lock(
                 loan_application_id=loan_application_id,
                 borrower_name=extracted_data.get('borrower_name'),  # NO FALLBACKS - must be extracted by LLM
                 borrower_email=from_address,  # NO FALLBACKS - must exist
                 borrower_phone=extracted_data.get('contact_phone', ''),
                 property_address=extracted_data.get('property_address', ''),
                 requested_lock_period=str(extracted_data.get('requested_lock_period_days', 30)),
-                additional_data=json.dumps(rate_lock_record)
+                additional_data=rate_lock_record
             )
-            
-            # Send to next agent in workflow
+            self._ensure_record_created(create_result, loan_application_id)
             await self._send_to_workflow(loan_application_id, from_address, extracted_data)
             
-            logger.info(f"{self.agent_name}: Successfully processed email for loan {loan_application_id}")
+            logger.info("%s: Successfully processed email for loan %s", self.agent_name, loan_application_id)
             
         except Exception as e:
             error_msg = f"Failed to process raw email with LLM: {str(e)}"
-            logger.error(f"{self.agent_name}: 🚨 CRITICAL ERROR - NO FALLBACKS: {error_msg}")
+            logger.error("%s: 🚨 CRITICAL ERROR - NO FALLBACKS: %s", self.agent_name, error_msg)
             # Re-raise to surface the real issue
             raise
 
     async def _extract_loan_data_with_llm(self, email_content: str) -> dict:
         """Direct LLM call to extract loan data from email content."""
+        cache_key = hashlib.blake2b(email_content.encode(), digest_size=16).digest()
+        cached = self._extraction_cache.get(cache_key)
+        if cached is not None:
+            self._extraction_cache.move_to_end(cache_key)
+            logger.info("%s: ♻️ Reusing cached LLM extraction for identical email content", self.agent_name)
+            return dict(cached)
+        
         prompt = f"""
 You are an AI agent that extracts loan application data from emails. Analyze the following email and extract key information.
 
@@ -202,22 +289,18 @@ Rules:
 JSON:"""
 
         try:
-            import json
-            import random
-            from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
-            
-            logger.info(f"{self.agent_name}: 🤖 Making LLM call to Azure OpenAI...")
-            logger.info(f"{self.agent_name}: 📝 Prompt length: {len(prompt)} characters")
+            logger.info("%s: 🤖 Making LLM call to Azure OpenAI...", self.agent_name)
+            logger.info("%s: 📝 Prompt length: %s characters", self.agent_name, len(prompt))
             
             # Use kernel to invoke prompt directly - simpler and more reliable
             response = await self.kernel.invoke_prompt(prompt)
             
-            logger.info(f"{self.agent_name}: ✅ LLM call completed successfully")
-            logger.info(f"{self.agent_name}: 📤 LLM Response type: {type(response)}")
+            logger.info("%s: ✅ LLM call completed successfully", self.agent_name)
+            logger.info("%s: 📤 LLM Response type: %s", self.agent_name, type(response))
             
             # Extract and clean the response
             extracted_json = str(response).strip()
-            logger.info(f"LLM raw response: {extracted_json[:200]}...")
+            logger.info("LLM raw response: %.200s...", extracted_json)
             
             # Clean up response if it has markdown formatting
             if extracted_json.startswith("```json"):
@@ -226,42 +309,45 @@ JSON:"""
                 extracted_json = extracted_json.replace("```", "").strip()
             
             # Parse the JSON
-            parsed_data = json.loads(extracted_json)
+            parsed_data = orjson.loads(extracted_json)
             
             # Validate required fields - NO FALLBACKS
-            if not parsed_data.get('loan_application_id') or parsed_data.get('loan_application_id') in [None, "", "null"]:
+            loan_application_id = parsed_data.get('loan_application_id')
+            if not loan_application_id or loan_application_id == "null":
                 raise ValueError(f"LLM failed to extract loan_application_id from email. Raw response: {extracted_json}")
             
-            logger.info(f"LLM successfully extracted loan ID: {parsed_data.get('loan_application_id')}")
+            logger.info("LLM successfully extracted loan ID: %s", loan_application_id)
+            
+            self._extraction_cache[cache_key] = dict(parsed_data)
+            if len(self._extraction_cache) > self.EXTRACTION_CACHE_SIZE:
+                self._extraction_cache.popitem(last=False)
             return parsed_data
             
         except Exception as e:
-            logger.error(f"{self.agent_name}: 🚨 LLM extraction failed: {str(e)}")
-            logger.error(f"{self.agent_name}: 🚨 Exception type: {type(e).__name__}")
-            logger.error(f"{self.agent_name}: 🚨 Full error details: {repr(e)}")
+            logger.error("%s: 🚨 LLM extraction failed: %s", self.agent_name, e)
+            logger.error("%s: 🚨 Exception type: %s", self.agent_name, type(e).__name__)
+            logger.error("%s: 🚨 Full error details: %s", self.agent_name, repr(e))
             
             # NO FALLBACKS - Re-raise the exception to surface the real issue
             raise Exception(f"LLM extraction failed and no fallbacks allowed: {str(e)}") from e
 
     def _extract_email_address(self, raw_email: str) -> str:
         """Extract 'From' email address from raw email content."""
-        import re
-        match = re.search(r'From:\s*([^\n\r]+)', raw_email, re.IGNORECASE)
+        match = _FROM_HEADER_RE.search(raw_email)
         return match.group(1).strip() if match else "unknown@unknown.com"
     
     def _extract_subject(self, raw_email: str) -> str:
         """Extract subject line from raw email content.""" 
-        import re
-        match = re.search(r'Subject:\s*([^\n\r]+)', raw_email, re.IGNORECASE)
+        match = _SUBJECT_HEADER_RE.search(raw_email)
         return match.group(1).strip() if match else "No Subject"
 
     async def _process_parsed_email(self, message: Dict[str, Any]):
         """Process a message that contains parsed email data."""
         # Email data could be at root level or nested in body
-        email_data = message.get('email_data', {}) or message.get('body', {}).get('email_data', {})
+        email_data = message.get('email_data') or (message.get('body') or {}).get('email_data') or {}
         
         if email_data.get('error'):
-            logger.error(f"Received email with parsing error: {email_data.get('error')}")
+            logger.error("Received email with parsing error: %s", email_data.get('error'))
             return
         
         from_address = email_data.get('from', '')
@@ -269,7 +355,7 @@ JSON:"""
         body_text = email_data.get('body_text', '')
         body_html = email_data.get('body_html', '')
         
-        logger.info(f"{self.agent_name}: Processing parsed email from {from_address} with subject '{subject[:50]}...'")
+        logger.info("%s: Processing parsed email from %s with subject '%.50s...'", self.agent_name, from_address, subject)
         
         # Use the email body (prefer text, fall back to HTML)
         email_body = body_text or body_html or ''
@@ -279,19 +365,14 @@ JSON:"""
             return
         
         # Extract loan application ID from subject or body
-        loan_application_id = await self._extract_loan_id_from_email(subject, email_body)
+        loan_application_id = self._extract_loan_id_from_email(subject, email_body)
         
         if not loan_application_id:
             logger.warning("Could not extract loan application ID from email, skipping")
             return
         
         # Use the LLM to extract full details from the email body
-        extraction_result_str = await self.kernel.invoke(
-            self.kernel.plugins["email_parser"]["extract_loan_data_from_email"],
-            email_body=email_body,
-            subject_loan_id=loan_application_id
-        )
-        extracted_data = json.loads(str(extraction_result_str))
+        extracted_data = await self._extract_email_data(email_body, loan_application_id)
         
         # Create the initial record in Cosmos DB
         rate_lock_record = {
@@ -302,12 +383,12 @@ JSON:"""
             "extracted_data": extracted_data,
             "raw_email_data": email_data
         }
-        await self.cosmos_plugin.create_rate_lock(loan_application_id, json.dumps(rate_lock_record))
-        
-        # Send to next agent
+        # Create the record and send to the next agent once it exists
+        create_result = await self.cosmos_plugin.create_rate_lock(loan_application_id, orjson.dumps(rate_lock_record).decode())
+        self._ensure_record_created(create_result, loan_application_id)
         await self._send_to_workflow(loan_application_id, from_address, extracted_data)
         
-        logger.info(f"Successfully processed parsed email for loan '{loan_application_id}'")
+        logger.info("Successfully processed parsed email for loan '%s'", loan_application_id)
 
     async def _process_legacy_email_request(self, message: Dict[str, Any]):
         """Process legacy message format for backwards compatibility."""
@@ -315,15 +396,10 @@ JSON:"""
         email_body = message.get('email_body')
         from_address = message.get('from_address')
         
-        logger.info(f"{self.agent_name}: Processing legacy email from {from_address} for loan '{loan_application_id_from_subject}'")
+        logger.info("%s: Processing legacy email from %s for loan '%s'", self.agent_name, from_address, loan_application_id_from_subject)
         
         # Use the LLM to extract full details from the email body
-        extraction_result_str = await self.kernel.invoke(
-            self.kernel.plugins["email_parser"]["extract_loan_data_from_email"],
-            email_body=email_body,
-            subject_loan_id=loan_application_id_from_subject
-        )
-        extracted_data = json.loads(str(extraction_result_str))
+        extracted_data = await self._extract_email_data(email_body, loan_application_id_from_subject)
 
         loan_application_id = extracted_data.get('loan_application_id') or loan_application_id_from_subject
         if not loan_application_id:
@@ -336,26 +412,27 @@ JSON:"""
             "received_at": datetime.utcnow().isoformat(),
             "extracted_data": extracted_data
         }
-        await self.cosmos_plugin.create_rate_lock(loan_application_id, json.dumps(rate_lock_record))
-        
-        # Send to next agent
+        # Create the record and send to the next agent once it exists
+        create_result = await self.cosmos_plugin.create_rate_lock(loan_application_id, orjson.dumps(rate_lock_record).decode())
+        self._ensure_record_created(create_result, loan_application_id)
         await self._send_to_workflow(loan_application_id, from_address, extracted_data)
         
-        logger.info(f"Successfully processed legacy email for loan '{loan_application_id}'")
+        logger.info("Successfully processed legacy email for loan '%s'", loan_application_id)
 
     async def _process_raw_message(self, message: Dict[str, Any]):
         """Process raw message content."""
         # Extract raw content from message body
         body = message.get('body', {})
-        if isinstance(body, dict) and 'raw_content' in body:
+        try:
             raw_content = body['raw_content']
-        else:
+        except (KeyError, TypeError):
+            # No raw_content field, or the body is not a dict at all
             raw_content = str(body)
         
-        logger.info(f"{self.agent_name}: Processing raw message content")
+        logger.info("%s: Processing raw message content", self.agent_name)
         
         # Try to extract basic information
-        loan_application_id = await self._extract_loan_id_from_text(raw_content)
+        loan_application_id = self._extract_loan_id_from_text(raw_content)
         
         if not loan_application_id:
             logger.warning("Could not extract loan application ID from raw content, skipping")
@@ -375,62 +452,79 @@ JSON:"""
             "received_at": datetime.utcnow().isoformat(),
             "extracted_data": extracted_data
         }
-        await self.cosmos_plugin.create_rate_lock(loan_application_id, json.dumps(rate_lock_record))
-        
-        # Send to next agent
+        # Create the record and send to the next agent once it exists
+        create_result = await self.cosmos_plugin.create_rate_lock(loan_application_id, orjson.dumps(rate_lock_record).decode())
+        self._ensure_record_created(create_result, loan_application_id)
         await self._send_to_workflow(loan_application_id, "unknown", extracted_data)
         
-        logger.info(f"Successfully processed raw message for loan '{loan_application_id}'")
+        logger.info("Successfully processed raw message for loan '%s'", loan_application_id)
 
-    async def _extract_loan_id_from_email(self, subject: str, body: str) -> Optional[str]:
-        """Extract loan application ID from email subject or body."""
-        # Simple regex patterns for loan IDs
-        import re
+    async def _extract_email_data(self, email_body: str, subject_loan_id: str) -> Dict[str, Any]:
+        """
+        Extract loan details from an email body with the email_parser kernel function.
+        Without one registered, the regex extraction is called directly, skipping the kernel dispatch.
+        """
+        if self._extract_fn is None:
+            return self._fallback_extract_data(email_body, subject_loan_id)
         
+        extraction_result = await self.kernel.invoke(
+            self._extract_fn,
+            email_body=email_body,
+            subject_loan_id=subject_loan_id
+        )
+        return orjson.loads(str(extraction_result))
+
+    def _extract_loan_id_from_email(self, subject: str, body: str) -> Optional[str]:
+        """Extract loan application ID from email subject or body."""
         # Look in subject first
-        for text in [subject, body]:
+        for text in (subject, body):
             if not text:
                 continue
-                
-            # Common patterns for loan IDs
-            patterns = [
-                r'loan[:\s]+([A-Z0-9-]{6,20})',
-                r'application[:\s]+([A-Z0-9-]{6,20})',  
-                r'loan[:\s]*id[:\s]*([A-Z0-9-]{6,20})',
-                r'([A-Z]{2,4}\d{6,12})',  # Pattern like ABC123456789
-                r'(\d{10,15})',  # Simple numeric IDs
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, text, re.IGNORECASE)
+            
+            for pattern in _LOAN_ID_PATTERNS:
+                match = pattern.search(text)
                 if match:
                     return match.group(1)
         
         return None
 
-    async def _extract_loan_id_from_text(self, text: str) -> Optional[str]:
+    def _extract_loan_id_from_text(self, text: str) -> Optional[str]:
         """Extract loan application ID from raw text."""
-        return await self._extract_loan_id_from_email("", text)
+        return self._extract_loan_id_from_email("", text)
+
+    def _ensure_record_created(self, create_result: Optional[Dict[str, Any]], loan_application_id: str):
+        """Raises if the rate lock record was not created; nothing may be sent about a record that doesn't exist."""
+        if not create_result or not create_result.get("success"):
+            error = create_result.get("error") if create_result else "no result"
+            raise ValueError(f"Failed to create rate lock record for {loan_application_id}: {error}")
 
     async def _send_to_workflow(self, loan_application_id: str, from_address: str, extracted_data: Dict[str, Any]):
-        """Send processed email data to the workflow."""
-        # Send audit message
-        await self._send_audit_message("EMAIL_PROCESSED", loan_application_id, {
-            "email_from": from_address,
-            "extracted_data": extracted_data
-        })
-        
-        # Send message to the next agent in the workflow
-        await self.servicebus_plugin.send_message_to_topic(
-            topic_name="loan_lifecycle",
-            message_type="context_retrieval_needed", 
-            loan_application_id=loan_application_id,
-            message_data={"status": "PENDING_CONTEXT"}
-        )
+        """
+        Send processed email data to the workflow once the rate lock record exists.
+        
+        The audit event, next-agent message and acknowledgment don't depend on each other,
+        so they are sent concurrently.
+        """
+        sends = [
+            # Send audit message
+            self._send_audit_message("EMAIL_PROCESSED", loan_application_id, {
+                "email_from": from_address,
+                "extracted_data": extracted_data
+            }),
+            # Send message to the next agent in the workflow
+            self.servicebus_plugin.send_message_to_topic(
+                topic_name="loan_lifecycle",
+                message_type="context_retrieval_needed", 
+                loan_application_id=loan_application_id,
+                message_data={"status": "PENDING_CONTEXT"}
+            )
+        ]
         
         # Send acknowledgment if we have a valid email address
         if from_address and '@' in from_address:
-            await self._send_acknowledgment_notification(from_address, loan_application_id, extracted_data)
+            sends.append(self._send_acknowledgment_notification(from_address, loan_application_id, extracted_data))
+        
+        await asyncio.gather(*sends)
 
     async def process_inbox(self):
         """
@@ -442,7 +536,7 @@ JSON:"""
             await self._initialize_kernel()
             ai_available = True
         except Exception as e:
-            logger.warning(f"AI services unavailable for demo: {str(e)}")
+            logger.warning("AI services unavailable for demo: %s", e)
             print(f"   ⚠️  Running in demo mode without AI services")
             ai_available = False
         
@@ -467,82 +561,99 @@ JSON:"""
         try:
             print(f"📨 Processing {len(sample_messages)} simulated email messages...")
             
-            for i, message in enumerate(sample_messages, 1):
-                print(f"   📧 Processing message {i}/{len(sample_messages)} from {message['from_address']}")
-                
-                # Process the message
-                loan_application_id = message.get('loan_application_id')
-                email_body = message.get('email_body')
-                from_address = message.get('from_address')
-                
-                if ai_available:
-                    # Extract data using AI
+            # Messages are independent: a fixed pool of workers drains a bounded queue, so
+            # processing starts while messages are still being fed in and in-flight work stays capped
+            inbox = asyncio.Queue(maxsize=self.INBOX_QUEUE_SIZE)
+            results = [None] * len(sample_messages)
+            worker_count = min(self.INBOX_WORKERS, len(sample_messages))
+            
+            async def feed_inbox():
+                for index, message in enumerate(sample_messages):
+                    await inbox.put((index, message))
+                for _ in range(worker_count):
+                    await inbox.put(None)  # One stop marker per worker
+            
+            async def inbox_worker():
+                while (item := await inbox.get()) is not None:
+                    index, message = item
                     try:
-                        extraction_result_str = await self.kernel.invoke(
-                            self.kernel.plugins["email_parser"]["extract_loan_data_from_email"],
-                            email_body=email_body,
-                            subject_loan_id=loan_application_id
-                        )
-                        extracted_data = json.loads(str(extraction_result_str))
+                        results[index] = await self._process_inbox_message(index + 1, len(sample_messages), message, ai_available)
                     except Exception as e:
-                        logger.warning(f"AI extraction failed, using fallback: {str(e)}")
-                        extracted_data = self._fallback_extract_data(email_body, loan_application_id)
-                else:
-                    # Use fallback extraction for demo
-                    extracted_data = self._fallback_extract_data(email_body, loan_application_id)
-                
-                print(f"   🤖 Extracted: Loan {extracted_data.get('loan_application_id')}, {extracted_data.get('requested_lock_period_days')} days")
-                
-                # Create rate lock record
-                rate_lock_record = {
-                    "rate_lock_id": f"RL{datetime.now().strftime('%Y%m%d%H%M%S')}{i:02d}",
-                    "loan_application_id": extracted_data.get("loan_application_id", loan_application_id),
-                    "borrower_email": from_address,
-                    "status": "PENDING_QUOTE",
-                    "requested_lock_period_days": extracted_data.get("requested_lock_period_days", 30),
-                    "borrower_name": extracted_data.get("borrower_name", "Unknown"),
-                    "property_address": extracted_data.get("property_address", "Unknown"),
-                    "created_timestamp": datetime.now().isoformat(),
-                    "updated_timestamp": datetime.now().isoformat()
-                }
-                
-                # Store in Cosmos DB (simulated for demo)
-                print(f"   💾 Creating rate lock record: {rate_lock_record['rate_lock_id']}")
-                
-                # Add to processed list
-                processed_requests.append(rate_lock_record)
-                
-                print(f"   ✅ Message processed successfully")
-                
-                # Small delay to simulate processing time
-                await asyncio.sleep(0.5)
+                        logger.error("Error processing inbox message from %s: %s", message.get('from_address'), e)
+                        print(f"   ❌ Error processing message from {message.get('from_address')}: {str(e)}")
+            
+            await asyncio.gather(feed_inbox(), *(inbox_worker() for _ in range(worker_count)))
+            
+            # Keep the original message order in the returned list
+            processed_requests.extend(result for result in results if result)
                 
         except Exception as e:
-            logger.error(f"Error in process_inbox demo: {str(e)}")
+            logger.error("Error in process_inbox demo: %s", e)
             print(f"   ❌ Error processing messages: {str(e)}")
         
         return processed_requests
     
+    async def _process_inbox_message(self, i: int, total: int, message: Dict[str, Any], ai_available: bool) -> Dict[str, Any]:
+        """Processes one simulated inbox message and returns the rate lock record for it."""
+        print(f"   📧 Processing message {i}/{total} from {message['from_address']}")
+        
+        # Process the message
+        loan_application_id = message.get('loan_application_id')
+        email_body = message.get('email_body')
+        from_address = message.get('from_address')
+        
+        if ai_available:
+            # Extract data using AI
+            try:
+                extracted_data = await self._extract_email_data(email_body, loan_application_id)
+            except Exception as e:
+                logger.warning("AI extraction failed, using fallback: %s", e)
+                extracted_data = self._fallback_extract_data(email_body, loan_application_id)
+        else:
+            # Use fallback extraction for demo
+            extracted_data = self._fallback_extract_data(email_body, loan_application_id)
+        
+        print(f"   🤖 Extracted: Loan {extracted_data.get('loan_application_id')}, {extracted_data.get('requested_lock_period_days')} days")
+        
+        # Create rate lock record; sample the clock once for both timestamps
+        now_iso = datetime.now().isoformat()
+        rate_lock_record = {
+            "rate_lock_id": f"{_RATE_LOCK_ID_PREFIX}{next(_rate_lock_id_counter):08d}",
+            "loan_application_id": extracted_data.get("loan_application_id", loan_application_id),
+            "borrower_email": from_address,
+            "status": "PENDING_QUOTE",
+            "requested_lock_period_days": extracted_data.get("requested_lock_period_days", 30),
+            "borrower_name": extracted_data.get("borrower_name", "Unknown"),
+            "property_address": extracted_data.get("property_address", "Unknown"),
+            "created_timestamp": now_iso,
+            "updated_timestamp": now_iso
+        }
+        
+        # Store in Cosmos DB (simulated for demo)
+        print(f"   💾 Creating rate lock record: {rate_lock_record['rate_lock_id']}")
+        
+        print(f"   ✅ Message processed successfully")
+        
+        return rate_lock_record
+    
     def _fallback_extract_data(self, email_body: str, subject_loan_id: str):
         """
         Fallback data extraction without AI for demo purposes.
         """
-        import re
-        
         # Try to find a loan ID in the body first
-        loan_id_match = re.search(r'LA\d{5,}', email_body, re.IGNORECASE)
+        loan_id_match = _FALLBACK_LOAN_ID_RE.search(email_body)
         loan_id = loan_id_match.group() if loan_id_match else subject_loan_id
         
         # Extract lock period
-        lock_period_match = re.search(r'(\d+)\s*day', email_body, re.IGNORECASE)
+        lock_period_match = _LOCK_PERIOD_RE.search(email_body)
         lock_period = int(lock_period_match.group(1)) if lock_period_match else 30
         
         # Extract name (simple heuristic)
-        name_match = re.search(r'(Best regards|Thanks|Sincerely),?\s*([A-Z][a-z]+\s+[A-Z][a-z]+)', email_body)
+        name_match = _SIGNATURE_NAME_RE.search(email_body)
         borrower_name = name_match.group(2) if name_match else "Unknown Borrower"
         
         # Extract address (simple heuristic)  
-        address_match = re.search(r'(\d+\s+[A-Za-z\s]+(?:St|Ave|Rd|Blvd|Dr)[^.]*)', email_body)
+        address_match = _STREET_ADDRESS_RE.search(email_body)
         property_address = address_match.group(1).strip() if address_match else "Address not found"
         
         return {
@@ -555,19 +666,12 @@ JSON:"""
     async def _send_acknowledgment_notification(self, recipient_email: str, loan_id: str, extracted_data: Dict[str, Any]):
         """Sends a message to the outbound email topic via Service Bus."""
         
-        subject = f"Rate Lock Request Received for Loan: {loan_id}"
-        body = f"""
-        Dear {extracted_data.get('borrower_name', 'Customer')},
-
-        Thank you for submitting your rate lock request for loan application {loan_id}.
-
-        We have received your request for a {extracted_data.get('requested_lock_period_days')}-day lock period. Our system is now gathering the required information from the Loan Origination System.
-
-        You will receive a separate email with your personalized rate quotes shortly.
-
-        Thank you,
-        The Automated Rate Lock System
-        """
+        subject = _ACK_SUBJECT_TMPL.format(loan_id=loan_id)
+        body = _ACK_BODY_TMPL.format(
+            borrower_name=extracted_data.get('borrower_name', 'Customer'),
+            loan_id=loan_id,
+            lock_period_days=extracted_data.get('requested_lock_period_days')
+        )
         
         email_payload = {
             "recipient_email": recipient_email,
@@ -582,18 +686,36 @@ JSON:"""
             loan_application_id=loan_id,
             message_data=email_payload
         )
-        logger.info(f"Sent acknowledgment notification request to Service Bus for loan '{loan_id}'")
+        logger.info("Sent acknowledgment notification request to Service Bus for loan '%s'", loan_id)
 
     async def _send_audit_message(self, action: str, loan_application_id: str, audit_data: Dict[str, Any]):
-        try:
-            await self.servicebus_plugin.send_audit_message(
-                agent_name=self.agent_name,
-                action=action,
-                loan_application_id=loan_application_id,
-                audit_data=json.dumps(audit_data)
-            )
-        except Exception as e:
-            logger.error(f"Failed to send audit message: {str(e)}")
+        """Queues an audit event for the background flusher; waits only if the queue is full."""
+        audit_event = {
+            "agent_name": self.agent_name,
+            "action": action,
+            "loan_application_id": loan_application_id,
+            "audit_data": audit_data,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        if not self._audit_sender.put_nowait(audit_event):
+            await self._audit_sender.put(audit_event)
+
+    async def _send_audit_batch(self, audit_events):
+        """Sends a batch of queued audit events to the audit logging topic."""
+        if await self.servicebus_plugin.send_audit_messages_batch(audit_events):
+            return
+        
+        # The batch is all-or-nothing, so retry each event on its own (as a one-event batch, which keeps
+        # its original timestamp) and keep only the ones that still fail
+        logger.warning("Failed to send batch of %d audit messages, retrying individually", len(audit_events))
+        results = await asyncio.gather(*(
+            self.servicebus_plugin.send_audit_messages_batch([audit_event]) for audit_event in audit_events
+        ))
+        unsent = [audit_event for audit_event, sent in zip(audit_events, results) if not sent]
+        if unsent:
+            spilled = await spill_to_jsonl(self._spill_path, unsent)
+            logger.error("Failed to send %d of %d audit messages. %s", len(unsent), len(audit_events),
+                         f"Saved to {self._spill_path}" if spilled else "Events could not be saved locally")
 
     async def _send_exception_alert(self, exception_type: str, priority: str, message: str, loan_application_id: str):
         try:
@@ -606,10 +728,10 @@ JSON:"""
                 exception_type=exception_type,
                 priority=priority,
                 loan_application_id=loan_application_id,
-                exception_data=json.dumps(exception_data)
+                exception_data=exception_data
             )
         except Exception as e:
-            logger.error(f"Failed to send exception alert: {str(e)}")
+            logger.error("Failed to send exception alert: %s", e)
 
     def get_agent_status(self):
         """
@@ -633,11 +755,16 @@ JSON:"""
             print(f"      ✅ Successfully registered for Service Bus messages")
             return True
         except Exception as e:
-            logger.error(f"Failed to register for workflow messages: {str(e)}")
+            logger.error("Failed to register for workflow messages: %s", e)
             return False
 
     async def close(self):
         if self._initialized:
+            # Send any queued audit events while Service Bus is still available
+            await self._audit_sender.aclose()
             if self.cosmos_plugin: await self.cosmos_plugin.close()
             if self.servicebus_plugin: await self.servicebus_plugin.close()
-        logger.info(f"{self.agent_name}: Resources cleaned up.")
\ No newline at end of file
+        if self._openai_credential:
+            await self._openai_credential.close()
+            self._openai_credential = None
+        logger.info("%s: Resources cleaned up.", self.agent_name)
\ No newline at end of file
@@ -4,8 +4,9 @@ Escalates complex cases and issues to human loan officers for review.
 """
 
 import asyncio
-import json
-from typing import Dict, Any
+import orjson
+from dataclasses import dataclass
+from typing import Dict, Any, List, Tuple
 from datetime import datetime, timedelta
 import logging
 import os
@@ -18,9 +19,90 @@ from semantic_kernel.functions import kernel_function
 # Import our plugins
 from plugins.cosmos_db_plugin import CosmosDBPlugin
 from plugins.service_bus_plugin import ServiceBusPlugin
+from utils.batching import AsyncBatchWriter
 
 logger = logging.getLogger(__name__)
 
+# Keyword found in an exception type -> exception category, checked in order
+_CATEGORY_KEYWORDS = (
+    ("COMPLIANCE", "COMPLIANCE"),
+    ("TECHNICAL", "TECHNICAL"),
+    ("PRICING", "TECHNICAL"),
+    ("LOGGING", "TECHNICAL"),
+)
+
+# Exception category -> (suggested assignee, summary template, estimated resolution hours)
+_CATEGORY_ANALYSIS = {
+    "COMPLIANCE": ("Compliance Team", "A compliance rule failed during processing. Details: {error_message}", 4),
+    "TECHNICAL": ("IT Support", "A technical error occurred in the '{agent_name}' agent. Details: {error_message}", 8),
+    "DATA": ("Loan Officer", "There is an issue with the loan data provided. Details: {error_message}", 2),
+}
+
+# Prompt for the LLM analysis in analyze_exception, filled in with str.format
+_ANALYSIS_PROMPT_TMPL = """\
+Analyze the following exception from our automated rate lock system and provide a structured JSON response.
+
+**Exception Details:**
+- Type: {exception_type}
+- Error Message: {error_message}
+- Full Context: {context}
+
+**Your Task:**
+Based on the information, generate a JSON object with the following keys:
+1. "summary": A concise, one-sentence summary of the problem for a human loan officer or IT support person.
+2. "suggested_assignee": Who should handle this? Your options are "Loan Officer", "IT Support", "Compliance Team", or "unassigned". Base this on the exception type and message.
+3. "estimated_resolution_time_hrs": An integer estimate of the hours needed to resolve this.
+
+**Assignee Guidelines:**
+- "COMPLIANCE_RISK": Assign to "Compliance Team".
+- "PRICING_UNAVAILABLE", "TECHNICAL_ERROR", "LOGGING_FAILURE": Assign to "IT Support".
+- "MISSING_DATA", "INVALID_LOAN_DATA": Assign to "Loan Officer".
+- If unsure, use "unassigned".
+
+**Example Response:**
+{{
+    "summary": "The compliance check failed because the borrower's debt-to-income ratio exceeds the maximum allowed limit.",
+    "suggested_assignee": "Compliance Team",
+    "estimated_resolution_time_hrs": 2
+}}
+
+**JSON Response:**
+"""
+
+
+@dataclass(slots=True)
+class ExceptionAnalysis:
+    """Result of analyzing an exception, as returned (in JSON form) by analyze_exception."""
+    summary: str
+    suggested_assignee: str
+    estimated_resolution_time_hrs: int
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "summary": self.summary,
+            "suggested_assignee": self.suggested_assignee,
+            "estimated_resolution_time_hrs": self.estimated_resolution_time_hrs
+        }
+
+    @classmethod
+    def from_dict(cls, analysis_data: Dict[str, Any]) -> "ExceptionAnalysis":
+        """Build an analysis from an analyze_exception JSON response, filling in defaults for missing keys."""
+        return cls(
+            summary=analysis_data.get("summary", "Analysis failed."),
+            suggested_assignee=analysis_data.get("suggested_assignee", "unassigned"),
+            estimated_resolution_time_hrs=analysis_data.get("estimated_resolution_time_hrs", 8)
+        )
+
+
+def _classify_exception_type(exception_type: str) -> str:
+    """Map an exception type to its category; anything unrecognised is treated as a loan data issue."""
+    exception_type = exception_type.upper()
+    for keyword, category in _CATEGORY_KEYWORDS:
+        if keyword in exception_type:
+            return category
+    return "DATA"
+
+
 class ExceptionHandlerAgent:
     """
     Role: Manages and escalates exceptions for human review.
@@ -29,6 +111,7 @@ class ExceptionHandlerAgent:
     - Listens for 'exception_alert' messages.
     - Uses an LLM to analyze, summarize, and categorize the exception.
     - Creates a detailed exception record in the 'Exceptions' container in Cosmos DB.
+      Records are queued and written in batches by a background flusher.
     - (Future) Assigns exceptions to the appropriate team/person based on rules.
     - (Future) Sends notifications about new high-priority exceptions.
     """
@@ -40,6 +123,18 @@ class ExceptionHandlerAgent:
         self.kernel = None
         self.cosmos_plugin = None
         self.servicebus_plugin = None
+        # Set once a chat completion service is registered; otherwise exceptions are analyzed locally
+        self._llm_enabled = False
+
+        # Exception records are buffered and written to Cosmos DB in batches,
+        # so a burst of alerts costs a few round-trips instead of one per alert
+        self._exception_writer = AsyncBatchWriter(
+            self._write_exception_batch,
+            name=self.agent_name,
+            batch_size=50,
+            flush_interval=0.25,
+            max_queue_size=4096
+        )
 
         self._initialized = False
 
@@ -55,14 +150,16 @@ class ExceptionHandlerAgent:
             api_key = os.environ.get("AZURE_OPENAI_API_KEY") 
             deployment_name = os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
             
-            if not all([endpoint, api_key, deployment_name]):
-                raise ValueError("Missing Azure OpenAI configuration for Exception Handler Agent.")
-
-            self.kernel.add_service(AzureChatCompletion(
-                deployment_name=deployment_name,
-                endpoint=endpoint,
-                api_key=api_key
-            ))
+            # The analysis is simulated today, so the agent can run without an LLM configured
+            if endpoint and api_key:
+                self.kernel.add_service(AzureChatCompletion(
+                    deployment_name=deployment_name,
+                    endpoint=endpoint,
+                    api_key=api_key
+                ))
+                self._llm_enabled = True
+            else:
+                logger.warning("%s: Azure OpenAI is not configured; exceptions will be analyzed locally", self.agent_name)
             
             self.cosmos_plugin = CosmosDBPlugin(debug=True, session_id=self.session_id)
             self.servicebus_plugin = ServiceBusPlugin(debug=True, session_id=self.session_id)
@@ -71,21 +168,24 @@ class ExceptionHandlerAgent:
             self.kernel.add_plugin(self.servicebus_plugin, plugin_name="service_bus")
             self.kernel.add_plugin(self, plugin_name="exception_analyzer")
             
+            self._exception_writer.start()
+            
             self._initialized = True
-            logger.info(f"{self.agent_name}: Semantic Kernel initialized successfully")
+            logger.info("%s: Semantic Kernel initialized successfully", self.agent_name)
             
         except Exception as e:
-            logger.error(f"{self.agent_name}: Failed to initialize Semantic Kernel - {str(e)}")
+            logger.error("%s: Failed to initialize Semantic Kernel - %s", self.agent_name, e)
             raise
 
     async def handle_message(self, message: Dict[str, Any]):
         """Handles a single exception message from the service bus."""
-        await self._initialize_kernel()
+        if not self._initialized:
+            await self._initialize_kernel()
         
         message_type = message.get('message_type')
         
         if message_type != 'exception_alert':
-            logger.warning(f"Received unexpected message type: {message_type}. Skipping.")
+            logger.warning("Received unexpected message type: %s. Skipping.", message_type)
             return
 
         try:
@@ -94,46 +194,72 @@ class ExceptionHandlerAgent:
             loan_application_id = message.get('loan_application_id')
             exception_data = message.get('exception_data', {})
             
-            logger.info(f"Processing '{priority}' priority exception '{exception_type}' for loan '{loan_application_id}'")
+            logger.info("Processing '%s' priority exception '%s' for loan '%s'", priority, exception_type, loan_application_id)
+
+            error_message = exception_data.get("error_message", "No message provided.")
+            agent_name = exception_data.get("agent", "unknown")
 
-            # Use the LLM to analyze the exception
-            analysis_result_str = await self.kernel.invoke(
-                self.kernel.plugins["exception_analyzer"]["analyze_exception"],
-                exception_type=exception_type,
-                error_message=exception_data.get("error_message", "No message provided."),
-                context=json.dumps(exception_data)
-            )
-            analysis_result = json.loads(str(analysis_result_str))
+            analysis = None
+            if self._llm_enabled:
+                # Use the LLM to analyze the exception
+                analysis_result_str = await self.kernel.invoke(
+                    self.kernel.plugins["exception_analyzer"]["analyze_exception"],
+                    exception_type=exception_type,
+                    error_message=error_message,
+                    context=orjson.dumps(exception_data).decode(),
+                    agent_name=agent_name
+                )
+                try:
+                    analysis = ExceptionAnalysis.from_dict(orjson.loads(str(analysis_result_str)))
+                except (ValueError, AttributeError) as e:
+                    # Malformed or non-object JSON from the analyzer: still record the exception,
+                    # using the rule-based analysis, rather than dropping it in the handler below
+                    logger.warning("%s: Unusable analysis for loan '%s' (%s); using rule-based analysis",
+                                   self.agent_name, loan_application_id, e)
+            if analysis is None:
+                # No chat service to route through (or its answer was unusable): analyze in-process
+                analysis = self._analyze(exception_type, error_message, agent_name)
 
             # Prepare the record for Cosmos DB
             exception_payload = {
                 "loan_application_id": loan_application_id,
                 "exception_type": exception_type,
                 "agent_name": exception_data.get("agent", "Unknown"),
-                "description": analysis_result.get("summary", "Analysis failed."),
+                "description": analysis.summary,
                 "context": exception_data,
-                "assignee": analysis_result.get("suggested_assignee", "unassigned"),
-                "estimated_resolution_time": analysis_result.get("estimated_resolution_time_hrs", 8)
+                "assignee": analysis.suggested_assignee,
+                "estimated_resolution_time": analysis.estimated_resolution_time_hrs
             }
 
-            # Call the CosmosDB plugin to create the exception record
-            result_str = await self.cosmos_plugin.create_exception(priority, json.dumps(exception_payload))
-            result = json.loads(result_str)
-
-            if not result.get("success"):
-                # This is a critical failure. If we can't log exceptions, the system is blind.
-                error_msg = f"CRITICAL: Failed to create exception record in Cosmos DB. Details: {result.get('error')}"
-                logger.error(error_msg)
-                # We won't send another exception alert to avoid a loop. Just log it.
+            # Queue the record; the background flusher writes it to Cosmos DB with others from the same window.
+            # If the queue is full the flusher is behind, so write this record directly instead of waiting for room.
+            if self._exception_writer.put_nowait((priority, exception_payload)):
+                logger.info("Queued exception record for loan '%s'", loan_application_id)
             else:
-                logger.info(f"Successfully created exception record {result.get('data', {}).get('exception_id')} for loan '{loan_application_id}'")
+                logger.warning("%s: Exception queue full, writing record for loan '%s' directly", self.agent_name, loan_application_id)
+                await self._write_exception_batch([(priority, exception_payload)])
 
         except Exception as e:
             # This is the 'meta-exception'. An exception occurred within the exception handler itself.
-            error_msg = f"FATAL: Unhandled error in ExceptionHandlerAgent: {str(e)}"
-            logger.critical(error_msg)
+            # Expected failures (an unusable analysis, a failed Cosmos write) are handled where they occur;
+            # this is the last guard keeping the listener alive.
+            logger.critical("FATAL: Unhandled error in ExceptionHandlerAgent: %s", e)
             # At this point, we can't trust our own exception bus. The best we can do is log to console.
 
+    async def _write_exception_batch(self, exceptions: List[Tuple[str, Dict[str, Any]]]):
+        """Writes a batch of queued exception records to Cosmos DB."""
+        result = await self.cosmos_plugin.create_exceptions_batch(exceptions)
+
+        if not result.get("success"):
+            # This is a critical failure. If we can't log exceptions, the system is blind.
+            failed = result.get("failed", [])
+            loan_ids = ", ".join(str(exception_data.get("loan_application_id")) for _, exception_data in failed)
+            logger.error("CRITICAL: Failed to create %d of %d exception records in Cosmos DB (loans: %s). Details: %s",
+                         len(failed), len(exceptions), loan_ids, result.get('error'))
+            # We won't send another exception alert to avoid a loop. Just log it.
+        else:
+            logger.info("Successfully created %s exception records", result.get('written'))
+
     @kernel_function(
         description="Analyzes a technical or business exception and provides a summary, suggested assignee, and estimated resolution time.",
         name="analyze_exception"
@@ -142,68 +268,35 @@ class ExceptionHandlerAgent:
         self,
         exception_type: str,
         error_message: str,
-        context: str
+        context: str,
+        agent_name: str = "unknown"
     ) -> str:
         """
         Uses an LLM to analyze an exception and return a structured JSON response.
         
         The prompt is designed to guide the LLM to provide a consistent, structured output
         that can be used to create a ticket or alert for human intervention.
+        The reporting agent is passed separately so it need not be parsed back out of the context JSON.
         """
         
-        prompt = f"""
-        Analyze the following exception from our automated rate lock system and provide a structured JSON response.
-
-        **Exception Details:**
-        - Type: {exception_type}
-        - Error Message: {error_message}
-        - Full Context: {context}
-
-        **Your Task:**
-        Based on the information, generate a JSON object with the following keys:
-        1. "summary": A concise, one-sentence summary of the problem for a human loan officer or IT support person.
-        2. "suggested_assignee": Who should handle this? Your options are "Loan Officer", "IT Support", "Compliance Team", or "unassigned". Base this on the exception type and message.
-        3. "estimated_resolution_time_hrs": An integer estimate of the hours needed to resolve this.
-
-        **Assignee Guidelines:**
-        - "COMPLIANCE_RISK": Assign to "Compliance Team".
-        - "PRICING_UNAVAILABLE", "TECHNICAL_ERROR", "LOGGING_FAILURE": Assign to "IT Support".
-        - "MISSING_DATA", "INVALID_LOAN_DATA": Assign to "Loan Officer".
-        - If unsure, use "unassigned".
-
-        **Example Response:**
-        {{
-            "summary": "The compliance check failed because the borrower's debt-to-income ratio exceeds the maximum allowed limit.",
-            "suggested_assignee": "Compliance Team",
-            "estimated_resolution_time_hrs": 2
-        }}
-
-        **JSON Response:**
-        """
-        # In a real scenario, you would invoke the LLM here.
+        # In a real scenario, you would format _ANALYSIS_PROMPT_TMPL and invoke the LLM here.
         # For this simulation, we are returning a pre-canned response based on the type.
         
-        if "COMPLIANCE" in exception_type.upper():
-            assignee = "Compliance Team"
-            summary = f"A compliance rule failed during processing. Details: {error_message}"
-            hours = 4
-        elif any(err in exception_type.upper() for err in ["TECHNICAL", "PRICING", "LOGGING"]):
-            assignee = "IT Support"
-            summary = f"A technical error occurred in the '{json.loads(context).get('agent', 'unknown')}' agent. Details: {error_message}"
-            hours = 8
-        else:
-            assignee = "Loan Officer"
-            summary = f"There is an issue with the loan data provided. Details: {error_message}"
-            hours = 2
+        return orjson.dumps(self._analyze(exception_type, error_message, agent_name).to_dict()).decode()
 
-        return json.dumps({
-            "summary": summary,
-            "suggested_assignee": assignee,
-            "estimated_resolution_time_hrs": hours
-        })
+    def _analyze(self, exception_type: str, error_message: str, agent_name: str) -> ExceptionAnalysis:
+        """Rule-based analysis behind analyze_exception, returned as a structured result."""
+        assignee, summary_tmpl, hours = _CATEGORY_ANALYSIS[_classify_exception_type(exception_type)]
+        return ExceptionAnalysis(
+            summary=summary_tmpl.format(error_message=error_message, agent_name=agent_name),
+            suggested_assignee=assignee,
+            estimated_resolution_time_hrs=hours
+        )
 
     async def close(self):
         if self._initialized:
+            # Flush queued exception records before the Cosmos client goes away
+            await self._exception_writer.aclose()
             if self.cosmos_plugin: await self.cosmos_plugin.close()
             if self.servicebus_plugin: await self.servicebus_plugin.close()
-        logger.info(f"{self.agent_name}: Resources cleaned up.")
\ No newline at end of file
+        logger.info("%s: Resources cleaned up.", self.agent_name)
\ No newline at end of file
@@ -4,12 +4,24 @@ Retrieves and verifies loan application data from the Loan Origination System (L
 """
 
 import asyncio
-from typing import Optional, Dict, Any
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
 from datetime import datetime
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
+# Loan statuses from which a rate lock may be requested
+_ELIGIBLE_LOAN_STATUSES = frozenset({"pre-approved", "underwritten", "conditionally_approved", "clear_to_close"})
+
+# Loan file flags checked for rate lock eligibility: (field, reason when missing, whether it blocks the lock)
+_ELIGIBILITY_FLAGS = (
+    ("income_verified", "Income verification required", True),
+    ("assets_verified", "Asset verification required", True),
+    ("appraisal_completed", "Appraisal pending - lock may be subject to value confirmation", False),
+)
+
 class LoanApplicationContextAgent:
     """
     Role: Retrieves and verifies loan application data.
@@ -20,13 +32,27 @@ class LoanApplicationContextAgent:
     - Confirm eligibility for rate lock
     """
     
+    # Loan applications fetched from the LOS are reused for a short while, since context retrieval,
+    # identity validation and loan officer lookups for the same loan tend to arrive together
+    LOAN_CACHE_TTL_SECONDS = 30
+    LOAN_CACHE_SIZE = 256
+    # Loan officer assignments rarely change, so they are kept much longer than the application itself
+    LOAN_OFFICER_CACHE_TTL_SECONDS = 600
+    LOAN_OFFICER_CACHE_SIZE = 4096
+    
     def __init__(self, los_service=None):
         self.los_service = los_service
         self.agent_name = "LoanApplicationContextAgent"
+        # loan_application_id -> (fetched_at, loan_data), in least-recently-used order
+        self._loan_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # LOS lookups currently in progress, shared by concurrent callers for the same loan
+        self._loan_inflight: Dict[str, asyncio.Task] = {}
+        # loan_application_id -> (fetched_at, loan_officer_info), in least-recently-used order
+        self._loan_officer_cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
     
     async def retrieve_loan_context(self, loan_application_id: str) -> Dict[str, Any]:
         """Retrieve complete loan application context from LOS."""
-        logger.info(f"{self.agent_name}: Retrieving context for loan {loan_application_id}")
+        logger.info("%s: Retrieving context for loan %s", self.agent_name, loan_application_id)
         
         try:
             # Fetch loan application data
@@ -35,11 +61,12 @@ class LoanApplicationContextAgent:
             if not loan_data:
                 raise ValueError(f"Loan application {loan_application_id} not found")
             
-            # Verify loan status
-            loan_status = await self._check_loan_status(loan_application_id)
+            # Verify loan status. The LOS already returns it with the application,
+            # so only make the separate status call when the payload lacks it
+            loan_status = loan_data.get('loan_status') or await self._check_loan_status(loan_application_id)
             
             # Check rate lock eligibility
-            eligibility = await self._check_rate_lock_eligibility(loan_data, loan_status)
+            eligibility = self._check_rate_lock_eligibility(loan_data, loan_status)
             
             # Build comprehensive context
             context = {
@@ -66,27 +93,52 @@ class LoanApplicationContextAgent:
                 }
             }
             
-            logger.info(f"{self.agent_name}: Successfully retrieved context for loan {loan_application_id}")
+            logger.info("%s: Successfully retrieved context for loan %s", self.agent_name, loan_application_id)
             return context
             
         except Exception as e:
-            logger.error(f"{self.agent_name}: Error retrieving loan context - {str(e)}")
+            logger.error("%s: Error retrieving loan context - %s", self.agent_name, e)
             raise
     
     async def _fetch_loan_application(self, loan_application_id: str) -> Optional[Dict[str, Any]]:
-        """Fetch loan application data from LOS."""
+        """Fetch loan application data from LOS, serving recent lookups from a TTL cache."""
         if not self.los_service:
             logger.warning("LOS service not configured")
             return None
         
+        cached = self._loan_cache.get(loan_application_id)
+        if cached is not None:
+            fetched_at, loan_data = cached
+            if time.monotonic() - fetched_at < self.LOAN_CACHE_TTL_SECONDS:
+                self._loan_cache.move_to_end(loan_application_id)
+                return loan_data
+            del self._loan_cache[loan_application_id]
+        
+        # Concurrent misses for the same loan wait on a single LOS call
+        task = self._loan_inflight.get(loan_application_id)
+        if task is None:
+            task = asyncio.create_task(self._load_loan_application(loan_application_id))
+            self._loan_inflight[loan_application_id] = task
+            task.add_done_callback(lambda _: self._loan_inflight.pop(loan_application_id, None))
+        
+        # Shielded so one caller being cancelled does not cancel the lookup for the others
+        return await asyncio.shield(task)
+    
+    async def _load_loan_application(self, loan_application_id: str) -> Optional[Dict[str, Any]]:
         try:
             # TODO: Implement actual LOS integration (Encompass, Blend, etc.)
             loan_data = await self.los_service.get_loan_application(loan_application_id)
-            return loan_data
             
         except Exception as e:
-            logger.error(f"Error fetching loan application: {str(e)}")
+            logger.error("Error fetching loan application: %s", e)
             return None
+        
+        # Only successful lookups are cached, so a failed or empty response is retried next time
+        if loan_data:
+            self._loan_cache[loan_application_id] = (time.monotonic(), loan_data)
+            if len(self._loan_cache) > self.LOAN_CACHE_SIZE:
+                self._loan_cache.popitem(last=False)
+        return loan_data
     
     async def _check_loan_status(self, loan_application_id: str) -> str:
         """Check current loan processing status."""
@@ -98,32 +150,25 @@ class LoanApplicationContextAgent:
             return status
             
         except Exception as e:
-            logger.error(f"Error checking loan status: {str(e)}")
+            logger.error("Error checking loan status: %s", e)
             return "Unknown"
     
-    async def _check_rate_lock_eligibility(self, loan_data: Dict[str, Any], loan_status: str) -> Dict[str, Any]:
+    def _check_rate_lock_eligibility(self, loan_data: Dict[str, Any], loan_status: str) -> Dict[str, Any]:
         """Determine if the loan is eligible for rate lock."""
         eligible = True
         reasons = []
         
         # Check loan status requirements
-        valid_statuses = ["pre-approved", "underwritten", "conditionally_approved", "clear_to_close"]
-        if loan_status.lower() not in valid_statuses:
+        if loan_status.lower() not in _ELIGIBLE_LOAN_STATUSES:
             eligible = False
             reasons.append(f"Loan status '{loan_status}' not eligible for rate lock")
         
-        # Check required documentation
-        if not loan_data.get('income_verified'):
-            eligible = False
-            reasons.append("Income verification required")
-        
-        if not loan_data.get('assets_verified'):
-            eligible = False
-            reasons.append("Asset verification required")
-        
-        # Check property appraisal
-        if not loan_data.get('appraisal_completed'):
-            reasons.append("Appraisal pending - lock may be subject to value confirmation")
+        # Check required documentation and property appraisal
+        for field, reason, blocking in _ELIGIBILITY_FLAGS:
+            if not loan_data.get(field):
+                if blocking:
+                    eligible = False
+                reasons.append(reason)
         
         # Check loan amount limits
         loan_amount = loan_data.get('loan_amount', 0)
@@ -163,32 +208,45 @@ class LoanApplicationContextAgent:
             if co_borrower.get('email', '').lower() == borrower_email.lower():
                 return True
             
-            logger.warning(f"Borrower email {borrower_email} does not match loan {loan_application_id}")
+            logger.warning("Borrower email %s does not match loan %s", borrower_email, loan_application_id)
             return False
             
         except Exception as e:
-            logger.error(f"Error validating borrower identity: {str(e)}")
+            logger.error("Error validating borrower identity: %s", e)
             return False
     
     async def get_loan_officer_info(self, loan_application_id: str) -> Optional[Dict[str, Any]]:
-        """Get loan officer information for the application."""
+        """Get loan officer information for the application, serving recent lookups from a TTL cache."""
+        cached = self._loan_officer_cache.get(loan_application_id)
+        if cached is not None:
+            fetched_at, loan_officer_info = cached
+            if time.monotonic() - fetched_at < self.LOAN_OFFICER_CACHE_TTL_SECONDS:
+                self._loan_officer_cache.move_to_end(loan_application_id)
+                return loan_officer_info
+            del self._loan_officer_cache[loan_application_id]
+        
         try:
             loan_data = await self._fetch_loan_application(loan_application_id)
             
             if not loan_data:
                 return None
             
-            loan_officer = loan_data.get('loan_officer', {})
+            loan_officer = loan_data.get('loan_officer') or {}
             
-            return {
+            loan_officer_info = {
                 "name": loan_officer.get('name'),
                 "email": loan_officer.get('email'),
                 "phone": loan_officer.get('phone'),
                 "nmls_id": loan_officer.get('nmls_id')
             }
             
+            self._loan_officer_cache[loan_application_id] = (time.monotonic(), loan_officer_info)
+            if len(self._loan_officer_cache) > self.LOAN_OFFICER_CACHE_SIZE:
+                self._loan_officer_cache.popitem(last=False)
+            return loan_officer_info
+            
         except Exception as e:
-            logger.error(f"Error getting loan officer info: {str(e)}")
+            logger.error("Error getting loan officer info: %s", e)
             return None
     
     async def update_loan_lock_request_status(self, loan_application_id: str, status: str) -> bool:
@@ -204,15 +262,17 @@ class LoanApplicationContextAgent:
             )
             
             if success:
-                logger.info(f"{self.agent_name}: Updated rate lock status to {status} for loan {loan_application_id}")
+                # The cached application no longer reflects the LOS
+                self._loan_cache.pop(loan_application_id, None)
+                logger.info("%s: Updated rate lock status to %s for loan %s", self.agent_name, status, loan_application_id)
             
             return success
             
         except Exception as e:
-            logger.error(f"Error updating loan lock status: {str(e)}")
+            logger.error("Error updating loan lock status: %s", e)
             return False
     
     async def close(self):
         """Clean up agent resources."""
         # Note: los_service cleanup would be handled by the service itself if needed
-        logger.info(f"{self.agent_name}: Resources cleaned up.")
\ No newline at end of file
+        logger.info("%s: Resources cleaned up.", self.agent_name)
\ No newline at end of file
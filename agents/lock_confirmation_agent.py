@@ -4,6 +4,7 @@ Executes the rate lock and sends confirmation notifications via Service Bus.
 """
 
 import asyncio
+import functools
 import json
 from typing import Dict, Any
 from datetime import datetime, timedelta
@@ -20,9 +21,40 @@ from plugins.service_bus_plugin import ServiceBusPlugin
 from plugins.pricing_engine_plugin import PricingEnginePlugin
 from plugins.los_plugin import LoanOriginationSystemPlugin
 from plugins.document_plugin import DocumentPlugin
+from models.loan_context import LoanContext
 
 logger = logging.getLogger(__name__)
 
+# Confirmation email text, filled in with str.format; the lock details section is shared by both emails
+_LOCK_DETAILS_TMPL = (
+    "Here are the details:\n"
+    "- Interest Rate: {interest_rate}%\n"
+    "- Lock Period: {lock_period_days} days\n"
+    "- Lock Expiration Date: {lock_expiration_date}\n"
+    "- Confirmation ID: {confirmation_id}\n\n"
+)
+_BORROWER_EMAIL_TMPL = (
+    "Dear {recipient_name},\n\n"
+    "Great news! Your rate lock for loan application {loan_id} is confirmed.\n\n"
+    "{details_block}"
+    "Your rate is now protected from market changes until the expiration date. "
+    "Please work with your loan officer to complete any outstanding items.\n\n"
+    "Thank you,\nThe Rate Lock Team"
+)
+_LOAN_OFFICER_EMAIL_TMPL = (
+    "Dear {recipient_name},\n\n"
+    "A rate lock has been executed for loan application {loan_id}.\n\n"
+    "{details_block}"
+    "Thank you,\nThe Rate Lock Team"
+)
+
+@functools.lru_cache(maxsize=1024)
+def _parse_iso(value: str) -> datetime:
+    """Parses an ISO 8601 timestamp, memoized since the same expiration dates recur across confirmations."""
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
 class LockConfirmationAgent:
     """
     Role: Executes the lock and sends confirmation notifications.
@@ -36,6 +68,9 @@ class LockConfirmationAgent:
     - Updates the rate lock record with the final 'Locked' status.
     """
     
+    # Trailing audit sends allowed to run in the background; beyond this they are awaited inline
+    MAX_BACKGROUND_TASKS = 100
+    
     def __init__(self):
         self.agent_name = "lock_confirmation_agent"
         self.session_id = f"lock_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -47,6 +82,9 @@ class LockConfirmationAgent:
         self.los_plugin = None
         self.document_plugin = None
         
+        # Audit sends run off the critical path; tracked so close() can await them
+        self._background_tasks = set()
+        
         self._initialized = False
 
     async def _initialize_kernel(self):
@@ -89,7 +127,8 @@ class LockConfirmationAgent:
 
     async def handle_message(self, message: Dict[str, Any]):
         """Handles a single message from the service bus."""
-        await self._initialize_kernel()
+        if not self._initialized:
+            await self._initialize_kernel()
         
         message_type = message.get('message_type')
         loan_application_id = message.get('loan_application_id')
@@ -110,8 +149,12 @@ class LockConfirmationAgent:
 
             loan_data = rate_lock_record.get("data", {})
             
-            # Assume the borrower selected the first rate option for this simulation
-            selected_rate = loan_data.get("rate_options", [{}])[0]
+            # Assume the borrower selected the first rate option for this simulation.
+            # A missing, null or empty list all mean there is nothing to lock
+            try:
+                selected_rate = loan_data["rate_options"][0]
+            except (KeyError, IndexError, TypeError):
+                selected_rate = None
             if not selected_rate:
                 raise ValueError("No rate options found in the record to lock.")
 
@@ -134,26 +177,35 @@ class LockConfirmationAgent:
                 confirmation_doc = doc_result.get("data")
 
             # 4. Send confirmation email notifications via Service Bus
-            borrower_info = loan_data.get("los_data", {}).get("borrower_info", {})
-            loan_officer_info = loan_data.get("los_data", {}).get("loan_officer_info", {})
-            
-            await self._send_confirmation_notifications(borrower_info, loan_officer_info, loan_application_id, lock_details, confirmation_doc)
+            # Flatten the nested LOS contact details once; the notification path reads plain attributes
+            loan_context = LoanContext.from_dict(loan_data)
 
             # 5. Update the Cosmos DB record with the final status
             new_status = "Locked"
-            update_payload = {
-                "status": new_status,
+            update_details = {
                 "lock_details": lock_details,
                 "locked_at": datetime.utcnow().isoformat(),
                 "confirmation_document_id": confirmation_doc.get("document_id") if confirmation_doc else None
             }
-            await self.cosmos_plugin.update_rate_lock(loan_application_id, json.dumps(update_payload))
+
+            # The record must be Locked before anyone is told it is, so the confirmations wait for this write.
+            # Any failure propagates to the exception alert below.
+            update_result = await self.cosmos_plugin.update_rate_lock_status(
+                loan_application_id=loan_application_id,
+                record_id=loan_data.get("id"),
+                new_status=new_status,
+                agent_name=self.agent_name,
+                update_details=json.dumps(update_details)
+            )
+            if not update_result.get("success"):
+                raise ValueError(f"Failed to mark rate lock as {new_status}: {update_result.get('error')}")
+            await self._send_confirmation_notifications(loan_context, loan_application_id, lock_details, confirmation_doc)
             
-            # 6. Send final audit message
-            await self._send_audit_message("RATE_LOCKED", loan_application_id, {
+            # 6. Send final audit message. Nothing after this depends on it, so don't hold up the handler
+            await self._run_in_background(self._send_audit_message("RATE_LOCKED", loan_application_id, {
                 "status": new_status,
                 "lock_id": lock_details.get("confirmation_id")
-            })
+            }))
             
             logger.info(f"Rate lock successfully executed and confirmed for loan '{loan_application_id}'.")
 
@@ -162,12 +214,27 @@ class LockConfirmationAgent:
             logger.error(error_msg)
             await self._send_exception_alert("TECHNICAL_ERROR", "high", error_msg, loan_application_id)
 
-    async def _send_confirmation_notifications(self, borrower_info, loan_officer_info, loan_id, lock_details, document):
+    async def _run_in_background(self, coro):
+        """Schedules coro as a tracked background task, or awaits it inline if too many are already pending."""
+        if len(self._background_tasks) >= self.MAX_BACKGROUND_TASKS:
+            # Backpressure: let the pending sends drain instead of growing the task set without bound
+            await coro
+            return
+        task = asyncio.create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _send_confirmation_notifications(self, loan_context: LoanContext, loan_id, lock_details, document):
         """Sends messages to Service Bus to trigger confirmation emails."""
+        # Both emails show the same lock details, so read and format them once
+        details_block = self._format_lock_details(lock_details)
+        
+        email_payloads = []
+        
         # Send to borrower
-        if borrower_info.get("email"):
+        if loan_context.borrower_email:
             subject = f"Rate Lock Confirmed for Loan {loan_id}"
-            body = self._create_email_body(borrower_info.get("name", "Borrower"), loan_id, lock_details)
+            body = self._create_email_body(loan_context.borrower_name or "Borrower", loan_id, details_block)
             
             # The attachment needs to be base64 encoded for the Logic App
             attachment_payload = None
@@ -177,69 +244,72 @@ class LockConfirmationAgent:
                     "ContentBytes": document.get("content_base64")
                 }]
 
-            await self._send_email_notification(
-                recipient_email=borrower_info["email"],
-                subject=subject,
-                body=body,
-                loan_id=loan_id,
-                attachments=attachment_payload
-            )
+            email_payloads.append(self._build_email_payload(loan_context.borrower_email, subject, body, attachment_payload))
         
         # Send to loan officer
-        if loan_officer_info.get("email"):
+        if loan_context.loan_officer_email:
             subject = f"ACTION: Rate Lock Executed for {loan_id}"
-            body = self._create_email_body(loan_officer_info.get("name", "Loan Officer"), loan_id, lock_details, is_lo=True)
-            await self._send_email_notification(
-                recipient_email=loan_officer_info["email"],
-                subject=subject,
-                body=body,
-                loan_id=loan_id
+            body = self._create_email_body(loan_context.loan_officer_name or "Loan Officer", loan_id, details_block, is_lo=True)
+            email_payloads.append(self._build_email_payload(loan_context.loan_officer_email, subject, body))
+        
+        if email_payloads:
+            # Both emails go to the same topic, so send them as one batch
+            sent = await self.servicebus_plugin.send_messages_batch_to_topic(
+                topic_name="outbound_email",
+                message_type="send_email_notification",
+                loan_application_id=loan_id,
+                messages_data=email_payloads
             )
+            if not sent and len(email_payloads) > 1:
+                # The batch is all-or-nothing (e.g. the PDF attachment can push it past the size limit),
+                # so retry the emails individually and concurrently rather than dropping both
+                logger.warning(f"Batched email send failed for loan '{loan_id}', sending {len(email_payloads)} emails individually")
+                results = await asyncio.gather(*(
+                    self.servicebus_plugin.send_message_to_topic(
+                        topic_name="outbound_email",
+                        message_type="send_email_notification",
+                        loan_application_id=loan_id,
+                        message_data=payload
+                    )
+                    for payload in email_payloads
+                ))
+                sent = all(results)
+            if sent:
+                logger.info(f"Sent {len(email_payloads)} email notification request(s) to Service Bus for loan '{loan_id}'")
+            else:
+                logger.error(f"Failed to send email notification request(s) to Service Bus for loan '{loan_id}'")
 
-    async def _send_email_notification(self, recipient_email: str, subject: str, body: str, loan_id: str, attachments: list = None):
-        """Constructs and sends an email notification message to the outbound Service Bus topic."""
-        email_payload = {
+    def _build_email_payload(self, recipient_email: str, subject: str, body: str, attachments: list = None) -> Dict[str, Any]:
+        """Constructs the email notification payload consumed by the outbound email topic."""
+        return {
             "recipient_email": recipient_email,
             "subject": subject,
             "body": body,
             "attachments": attachments or []
         }
-        
-        await self.servicebus_plugin.send_message_to_topic(
-            topic_name="outbound_email",
-            message_type="send_email_notification",
-            loan_application_id=loan_id,
-            message_data=email_payload
-        )
-        logger.info(f"Sent email notification request to Service Bus for '{recipient_email}'")
 
-
-    def _create_email_body(self, recipient_name, loan_id, lock_details, is_lo=False):
-        """Creates a formatted email body."""
+    def _format_lock_expiration(self, lock_details):
+        """Formats the lock expiration date for display in emails."""
         lock_expiration_str = lock_details.get('lock_expiration_date', 'N/A')
         try:
             # Format the date for readability
-            lock_expiration_date = datetime.fromisoformat(lock_expiration_str).strftime('%B %d, %Y')
-        except (ValueError, TypeError):
-            lock_expiration_date = lock_expiration_str
+            return _parse_iso(lock_expiration_str).strftime('%B %d, %Y')
+        except (ValueError, TypeError, AttributeError):
+            return lock_expiration_str
 
-        body = f"Dear {recipient_name},\n\n"
-        if is_lo:
-            body += f"A rate lock has been executed for loan application {loan_id}.\n\n"
-        else:
-            body += f"Great news! Your rate lock for loan application {loan_id} is confirmed.\n\n"
-        
-        body += "Here are the details:\n"
-        body += f"- Interest Rate: {lock_details.get('interest_rate')}%\n"
-        body += f"- Lock Period: {lock_details.get('lock_period_days')} days\n"
-        body += f"- Lock Expiration Date: {lock_expiration_date}\n"
-        body += f"- Confirmation ID: {lock_details.get('confirmation_id')}\n\n"
-        
-        if not is_lo:
-            body += "Your rate is now protected from market changes until the expiration date. Please work with your loan officer to complete any outstanding items.\n\n"
-        
-        body += "Thank you,\nThe Rate Lock Team"
-        return body
+    def _format_lock_details(self, lock_details):
+        """Formats the lock details section shared by the borrower and loan officer emails."""
+        return _LOCK_DETAILS_TMPL.format(
+            interest_rate=lock_details.get('interest_rate'),
+            lock_period_days=lock_details.get('lock_period_days'),
+            lock_expiration_date=self._format_lock_expiration(lock_details),
+            confirmation_id=lock_details.get('confirmation_id')
+        )
+
+    def _create_email_body(self, recipient_name, loan_id, details_block, is_lo=False):
+        """Creates a formatted email body around the pre-formatted lock details section."""
+        template = _LOAN_OFFICER_EMAIL_TMPL if is_lo else _BORROWER_EMAIL_TMPL
+        return template.format(recipient_name=recipient_name, loan_id=loan_id, details_block=details_block)
 
     async def _send_audit_message(self, action: str, loan_application_id: str, audit_data: Dict[str, Any]):
         try:
@@ -247,7 +317,7 @@ class LockConfirmationAgent:
                 agent_name=self.agent_name,
                 action=action,
                 loan_application_id=loan_application_id,
-                audit_data=json.dumps(audit_data)
+                audit_data=audit_data
             )
         except Exception as e:
             logger.error(f"Failed to send audit message: {str(e)}")
@@ -263,13 +333,16 @@ class LockConfirmationAgent:
                 exception_type=exception_type,
                 priority=priority,
                 loan_application_id=loan_application_id,
-                exception_data=json.dumps(exception_data)
+                exception_data=exception_data
             )
         except Exception as e:
             logger.error(f"Failed to send exception alert: {str(e)}")
 
     async def close(self):
         if self._initialized:
+            # Let in-flight audit sends finish before the Service Bus client goes away
+            if self._background_tasks:
+                await asyncio.gather(*self._background_tasks, return_exceptions=True)
             if self.cosmos_plugin: await self.cosmos_plugin.close()
             if self.servicebus_plugin: await self.servicebus_plugin.close()
             if self.pricing_plugin: await self.pricing_plugin.close()
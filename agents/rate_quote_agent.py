@@ -4,9 +4,10 @@ Connects to a pricing engine to generate rate options based on the loan context.
 """
 
 import asyncio
+import hashlib
 import json
 from typing import Optional, Dict, Any, List
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
 import os
 
@@ -81,7 +82,8 @@ class RateQuoteAgent:
 
     async def handle_message(self, message: Dict[str, Any]):
         """Handles a single message from the service bus."""
-        await self._initialize_kernel()
+        if not self._initialized:
+            await self._initialize_kernel()
         
         message_type = message.get('message_type')
         loan_application_id = message.get('loan_application_id')
@@ -107,47 +109,91 @@ class RateQuoteAgent:
             if not los_data:
                 raise ValueError(f"LOS data is missing from the rate lock record for {loan_application_id}")
 
-            # 2. Get rate options from the pricing engine
-            rate_options_str = await self.pricing_plugin.get_rate_options(json.dumps(los_data))
-            rate_options = json.loads(rate_options_str)
+            # 2. Get rate options from the pricing engine, unless the record already holds unexpired quotes
+            # priced from these same LOS inputs (e.g. a redelivered or repeated message for the same loan)
+            los_data_json = json.dumps(los_data)
+            pricing_inputs_hash = self._hash_pricing_inputs(los_data)
+            quotes = self._get_reusable_rate_options(loan_data, pricing_inputs_hash)
+            new_status = "RateOptionsPresented"
+            if quotes is None:
+                rate_options_str = await self.pricing_plugin.get_rate_options(los_data_json)
+                rate_options = json.loads(rate_options_str)
 
-            if not rate_options.get("success"):
-                raise ValueError(f"Failed to get rate options: {rate_options.get('error')}")
+                if not rate_options.get("success"):
+                    raise ValueError(f"Failed to get rate options: {rate_options.get('error')}")
+                quotes = rate_options.get("data") or []
 
-            # 3. Update the Cosmos DB record with the rate options
-            new_status = "RateOptionsPresented"
-            update_payload = {
-                "status": new_status,
-                "rate_options": rate_options.get("data"),
-                "rates_presented_at": datetime.utcnow().isoformat()
-            }
-            await self.cosmos_plugin.update_rate_lock(loan_application_id, json.dumps(update_payload))
-            
-            # 4. Send audit message
-            await self._send_audit_message("RATES_GENERATED", loan_application_id, {
-                "status": new_status, 
-                "quote_count": len(rate_options.get("data", []))
-            })
+                # 3. Update the Cosmos DB record with the rate options and the inputs they were priced from
+                update_payload = {
+                    "status": new_status,
+                    "rate_options": quotes,
+                    "rate_options_inputs_hash": pricing_inputs_hash,
+                    "rates_presented_at": datetime.utcnow().isoformat()
+                }
+                await self.cosmos_plugin.update_rate_lock(loan_application_id, json.dumps(update_payload))
+            elif loan_data.get("status") != new_status:
+                # The workflow has already moved past presentation (compliance ran on these exact quotes),
+                # so there is nothing to redo and compliance must not be re-triggered
+                logger.info(f"Rate options for loan '{loan_application_id}' are unchanged and already processed; skipping.")
+                return
+            else:
+                # Still awaiting compliance: the earlier attempt may have stopped before sending
+                # rates_presented, so send it again. Compliance on identical quotes gives the same result.
+                logger.info(f"Reusing {len(quotes)} unexpired rate options for loan '{loan_application_id}'")
             
-            # 5. Send workflow message for the next agent
-            await self._send_workflow_message("rates_presented", loan_application_id, {
-                "loan_application_id": loan_application_id,
-                "next_action": "compliance_check"
-            })
-            logger.info(f"Generated {len(rate_options.get('data', []))} rate options for loan '{loan_application_id}'.")
+            # 4 & 5. Send the audit message and the workflow message for the next agent.
+            # The two sends are independent (each helper logs its own failure), so run them concurrently.
+            await asyncio.gather(
+                self._send_audit_message("RATES_GENERATED", loan_application_id, {
+                    "status": new_status, 
+                    "quote_count": len(quotes)
+                }),
+                self._send_workflow_message("rates_presented", loan_application_id, {
+                    "loan_application_id": loan_application_id,
+                    "next_action": "compliance_check"
+                })
+            )
+            logger.info(f"Presented {len(quotes)} rate options for loan '{loan_application_id}'.")
 
         except Exception as e:
             error_msg = f"Failed to process rate quote for loan '{loan_application_id}': {str(e)}"
             logger.error(error_msg)
             await self._send_exception_alert("TECHNICAL_ERROR", "high", error_msg, loan_application_id)
 
+    @staticmethod
+    def _hash_pricing_inputs(los_data: Dict[str, Any]) -> str:
+        """Fingerprint of the LOS data sent to the pricing engine, independent of key order."""
+        return hashlib.sha256(json.dumps(los_data, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _get_reusable_rate_options(self, loan_data: Dict[str, Any], pricing_inputs_hash: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Returns the record's stored rate options if they were priced from the same inputs and every
+        quote is still before its expires_at, else None.
+        """
+        quotes = loan_data.get("rate_options")
+        if not quotes or loan_data.get("rate_options_inputs_hash") != pricing_inputs_hash:
+            return None
+        now = datetime.now(timezone.utc)
+        try:
+            for quote in quotes:
+                expires_at = datetime.fromisoformat(quote["expires_at"])
+                # The pricing engine writes naive UTC timestamps; offset-aware ones are compared as-is
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                if expires_at <= now:
+                    return None
+        except (KeyError, TypeError, ValueError):
+            # Quotes without a usable expiry are treated as stale and re-priced
+            return None
+        return quotes
+
     async def _send_audit_message(self, action: str, loan_application_id: str, audit_data: Dict[str, Any]):
         try:
             await self.servicebus_plugin.send_audit_message(
                 agent_name=self.agent_name,
                 action=action,
                 loan_application_id=loan_application_id,
-                audit_data=json.dumps(audit_data)
+                audit_data=audit_data
             )
         except Exception as e:
             logger.error(f"Failed to send audit message: {str(e)}")
@@ -174,7 +220,7 @@ class RateQuoteAgent:
                 exception_type=exception_type,
                 priority=priority,
                 loan_application_id=loan_application_id,
-                exception_data=json.dumps(exception_data)
+                exception_data=exception_data
             )
         except Exception as e:
             logger.error(f"Failed to send exception alert: {str(e)}")
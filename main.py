@@ -8,7 +8,10 @@ Runs all agents autonomously to process rate lock requests continuously.
 
 import os
 import asyncio
+import atexit
 import logging
+import logging.handlers
+from queue import SimpleQueue
 import signal
 import sys
 from dotenv import load_dotenv
@@ -16,6 +19,7 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 import os
+from collections import Counter
 from datetime import datetime
 from typing import Dict, Any, List
 
@@ -32,15 +36,27 @@ os.makedirs('logs', exist_ok=True)
 for handler in logging.root.handlers[:]:
     logging.root.removeHandler(handler)
 
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.FileHandler(log_filename, mode='w', encoding='utf-8'),  # Fresh file each run
+    logging.StreamHandler(sys.stdout)
+]
+for log_handler in log_handlers:
+    log_handler.setFormatter(log_formatter)
+
+# Agents log from the event loop; hand records to a queue so the file and console
+# writes happen on the listener thread instead of blocking the loop.
+log_queue = SimpleQueue()
+log_queue_handler = logging.handlers.QueueHandler(log_queue)
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Final formatting happens in the listener's handlers
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_filename, mode='w', encoding='utf-8'),  # Fresh file each run
-        logging.StreamHandler(sys.stdout)
-    ],
+    handlers=[log_queue_handler],
     force=True  # Force reconfiguration
 )
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)  # Flush queued records on interpreter exit
 
 # Reduce Azure SDK noise while keeping important messages
 azure_loggers = [
@@ -78,6 +94,7 @@ from agents.lock_confirmation_agent import LockConfirmationAgent
 from agents.audit_logging_agent import AuditLoggingAgent
 from agents.exception_handler_agent import ExceptionHandlerAgent
 from operations.service_bus_operations import ServiceBusOperations
+from plugins.service_bus_plugin import servicebus_operations as shared_servicebus_operations
 from operations.service_bus_singleton import close_service_bus_connection
 from config.azure_config import AzureConfig
 
@@ -204,6 +221,9 @@ class AIRateLockSystem:
         queues = config.get('queues', [])
         poll_count = 0
         
+        # Resolve the handlers once instead of branching on the agent name per message
+        topic_handler, queue_handler = self._get_message_handlers(agent_name, agent_instance)
+        
         logger.info(f"🔄 {agent_name} listener started - monitoring topics: {topics}, queues: {queues}")
         
         while self.running:
@@ -225,42 +245,23 @@ class AIRateLockSystem:
                             logger.info(f"📨 {agent_name} received message from topic {topic}")
                             
                             # Route message to appropriate agent handler
-                            if agent_name == 'email_intake':
-                                # Extract raw message body for LLM processing
-                                message_body = message.get('body', str(message))
-                                await agent_instance.handle_message(message_body)
-                            elif agent_name == 'rate_quote':
-                                await agent_instance.handle_message(message)
+                            if topic_handler:
+                                await topic_handler(message)
                             
                             logger.info(f"✅ {agent_name} processed message successfully")
                 
                 # Check for messages from Service Bus queues
-                for queue in queues:
-                    messages = await self._check_for_queue_messages(queue)
+                for queue_name in queues:
+                    messages = await self._check_for_queue_messages(queue_name)
                     
                     if messages:
                         messages_found = True
                         for message in messages:
-                            logger.info(f"📨 {agent_name} received message from queue {queue}")
+                            logger.info(f"📨 {agent_name} received message from queue {queue_name}")
                             
                             # Route message to appropriate agent handler
-                            if agent_name == 'email_intake':
-                                # Extract raw message body for LLM processing - FIXED: properly convert generator to string
-                                raw_body = message.get('body', '')
-                                if hasattr(raw_body, '__iter__') and not isinstance(raw_body, str):
-                                    # Convert generator or bytes to string
-                                    try:
-                                        message_body = ''.join(raw_body) if isinstance(raw_body, (list, tuple)) else ''.join(str(chunk) for chunk in raw_body)
-                                    except:
-                                        message_body = str(raw_body)
-                                else:
-                                    message_body = str(raw_body)
-                                    
-                                logger.info(f"📨 {agent_name} message body type: {type(raw_body)} -> {type(message_body)}")
-                                logger.info(f"📨 {agent_name} message preview: {message_body[:100]}...")
-                                await agent_instance.handle_message(message_body)
-                            elif agent_name == 'rate_quote':
-                                await agent_instance.handle_message(message)
+                            if queue_handler:
+                                await queue_handler(message)
                             
                             logger.info(f"✅ {agent_name} processed message successfully")
                 
@@ -275,6 +276,36 @@ class AIRateLockSystem:
                 logger.error(f"❌ Error in {agent_name} listener: {str(e)}")
                 await asyncio.sleep(10)  # Longer delay on error
 
+    def _get_message_handlers(self, agent_name: str, agent_instance: Any):
+        """Return the (topic, queue) message handlers for an agent; None where it has no handler."""
+        
+        async def email_from_topic(message: Dict[str, Any]):
+            # Extract raw message body for LLM processing
+            message_body = message.get('body', str(message))
+            await agent_instance.handle_message(message_body)
+        
+        async def email_from_queue(message: Dict[str, Any]):
+            # Extract raw message body for LLM processing - FIXED: properly convert generator to string
+            raw_body = message.get('body', '')
+            if hasattr(raw_body, '__iter__') and not isinstance(raw_body, str):
+                # Convert generator or bytes to string
+                try:
+                    message_body = ''.join(raw_body) if isinstance(raw_body, (list, tuple)) else ''.join(str(chunk) for chunk in raw_body)
+                except:
+                    message_body = str(raw_body)
+            else:
+                message_body = str(raw_body)
+                
+            logger.info(f"📨 {agent_name} message body type: {type(raw_body)} -> {type(message_body)}")
+            logger.info(f"📨 {agent_name} message preview: {message_body[:100]}...")
+            await agent_instance.handle_message(message_body)
+        
+        message_handlers = {
+            'email_intake': (email_from_topic, email_from_queue),
+            'rate_quote': (agent_instance.handle_message, agent_instance.handle_message),
+        }
+        return message_handlers.get(agent_name, (None, None))
+
     async def _check_for_messages(self, topic: str, subscription: str) -> List[Dict[str, Any]]:
         """Check for messages from Service Bus topic/subscription."""
         try:
@@ -326,11 +357,15 @@ class AIRateLockSystem:
         
         logger.info("📊 === SYSTEM STATUS REPORT ===")
         logger.info(f"⏱️  System Uptime: {uptime}")
-        logger.info(f"🔧 Active Agents: {len([a for a in self.agents.values() if a['status'] == 'LISTENING'])}")
         
+        # Single pass: log each agent and tally statuses as we go
+        status_counts = Counter()
         for agent_name, agent_data in self.agents.items():
             status = agent_data['status']
+            status_counts[status] += 1
             logger.info(f"   🤖 {agent_name}: {status}")
+        
+        logger.info(f"🔧 Active Agents: {status_counts['LISTENING']} ({dict(status_counts)})")
 
     async def run_system(self):
         """Main system execution loop."""
@@ -384,7 +419,12 @@ class AIRateLockSystem:
             except Exception as e:
                 logger.error(f"❌ Error cleaning up {agent_name}: {str(e)}")
         
-        # Clean up any remaining Service Bus credentials to prevent session warnings
+        # Clean up any remaining Service Bus credentials to prevent session warnings.
+        # The agents' plugins share one ServiceBusOperations, closed here once every agent is done with it
+        try:
+            await shared_servicebus_operations.cleanup_all_credentials()
+        except Exception as e:
+            logger.debug(f"Error during shared credential cleanup: {e}")
         if self.service_bus:
             try:
                 await self.service_bus.cleanup_all_credentials()
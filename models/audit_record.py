@@ -0,0 +1,27 @@
+# Audit event queued by the audit agent and written to the AuditLogs container
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+
+@dataclass(slots=True)
+class AuditRecord:
+    agent_name: str
+    action: str
+    loan_application_id: Optional[str] = None
+    details: Dict[str, Any] = field(default_factory=dict)
+    outcome: str = "SUCCESS"
+    event_type: str = "UNKNOWN"
+    timestamp: Optional[str] = None  # Event time (ISO 8601); write time is used when missing
+
+    @classmethod
+    def from_dict(cls, audit_data: Dict[str, Any]) -> "AuditRecord":
+        """Build a record from the snake_case dict shape used by the plugins."""
+        return cls(
+            agent_name=audit_data.get('agent_name', 'Unknown'),
+            action=audit_data.get('action'),
+            loan_application_id=audit_data.get('loan_application_id'),
+            details=audit_data.get('details') or {},
+            outcome=audit_data.get('outcome') or 'SUCCESS',
+            event_type=audit_data.get('event_type', 'UNKNOWN'),
+            timestamp=audit_data.get('timestamp')
+        )
@@ -0,0 +1,26 @@
+# Contact details read from a rate lock record's LOS data, flattened once when a lock is confirmed
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+
+@dataclass(slots=True)
+class LoanContext:
+    loan_application_id: Optional[str] = None
+    borrower_name: Optional[str] = None
+    borrower_email: Optional[str] = None
+    loan_officer_name: Optional[str] = None
+    loan_officer_email: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, loan_data: Dict[str, Any]) -> "LoanContext":
+        """Build a context from the rate lock record shape stored in Cosmos DB."""
+        los_data = loan_data.get('los_data') or {}
+        borrower_info = los_data.get('borrower_info') or {}
+        loan_officer_info = los_data.get('loan_officer_info') or {}
+        return cls(
+            loan_application_id=loan_data.get('loan_application_id'),
+            borrower_name=borrower_info.get('name'),
+            borrower_email=borrower_info.get('email'),
+            loan_officer_name=loan_officer_info.get('name'),
+            loan_officer_email=loan_officer_info.get('email')
+        )
@@ -1,15 +1,27 @@
 import os
 import json
+import itertools
+import uuid
 from datetime import datetime, timedelta
-from typing import Dict, Optional, Any, List
+from typing import Dict, Optional, Any, List, Tuple
 import asyncio
 from azure.cosmos.aio import CosmosClient
 from azure.cosmos import exceptions, PartitionKey
 from azure.identity.aio import DefaultAzureCredential
 from utils.logger import console_info, console_debug, console_warning, console_error, console_telemetry_event
+from models.audit_record import AuditRecord
+
+# Cosmos DB item ttl is a duration in seconds (relative to the item's last write), not an expiry timestamp
+AUDIT_LOG_TTL_SECONDS = int(timedelta(days=30).total_seconds())
+EXCEPTION_TTL_SECONDS = int(timedelta(days=90).total_seconds())
 
 
 class CosmosDBOperations:
+    # Cosmos DB limits a transactional batch to 100 operations
+    MAX_BATCH_OPERATIONS = 100
+    # ...and a single patch request to 10 operations
+    MAX_PATCH_OPERATIONS = 10
+
     def __init__(self):
         """
         Initialize the CosmosDBOperations class.
@@ -34,6 +46,13 @@ class CosmosDBOperations:
         # Cache for container references
         self._container_cache = {}
         
+        # Audit log ids: per-process prefix plus a monotonic counter (unique without a clock read)
+        self._audit_id_prefix = f"audit_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self._audit_id_counter = itertools.count()
+        # Exception ids follow the same scheme, so a burst of exceptions cannot collide on the timestamp
+        self._exception_id_prefix = f"exc_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self._exception_id_counter = itertools.count()
+        
         console_info(f"Cosmos DB Operations initialized", "CosmosDBOps")
         console_info(f"Endpoint: {self.cosmos_endpoint}", "CosmosDBOps")
         console_info(f"Database: {self.database_name}", "CosmosDBOps")
@@ -111,12 +130,16 @@ class CosmosDBOperations:
         try:
             container = await self._get_container('rate_lock_records')
             
+            # Sample the clock once so the default id and both timestamps agree
+            now = datetime.utcnow()
+            now_iso = now.isoformat()
+            
             # Ensure required fields
             record = {
-                'id': rate_lock_data.get('id', f"rate_lock_{loan_application_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}"),
+                'id': rate_lock_data['id'] if 'id' in rate_lock_data else f"rate_lock_{loan_application_id}_{now.strftime('%Y%m%d_%H%M%S')}",
                 'loanApplicationId': loan_application_id,  # Partition key
-                'created_at': datetime.utcnow().isoformat(),
-                'updated_at': datetime.utcnow().isoformat(),
+                'created_at': now_iso,
+                'updated_at': now_iso,
                 'status': rate_lock_data.get('status', 'PendingRequest'),
                 **rate_lock_data
             }
@@ -155,16 +178,18 @@ class CosmosDBOperations:
                 response = await container.read_item(item=record_id, partition_key=loan_application_id)
                 return dict(response)
             else:
-                # Query for records by loan application ID
-                query = "SELECT * FROM c WHERE c.loanApplicationId = @loan_app_id ORDER BY c.created_at DESC"
+                # Query for the newest record by loan application ID; TOP 1 keeps the server
+                # from returning (and us from buffering) every older record for the loan
+                query = "SELECT TOP 1 * FROM c WHERE c.loanApplicationId = @loan_app_id ORDER BY c.created_at DESC"
                 items = container.query_items(
                     query=query,
                     parameters=[{"name": "@loan_app_id", "value": loan_application_id}],
                     partition_key=loan_application_id
                 )
                 
-                records = [dict(item) async for item in items]
-                return records[0] if records else None
+                async for item in items:
+                    return dict(item)
+                return None
                 
         except exceptions.CosmosResourceNotFoundError:
             console_warning(f"Rate lock record not found for loan {loan_application_id}", "CosmosDBOps")
@@ -189,18 +214,20 @@ class CosmosDBOperations:
         try:
             container = await self._get_container('rate_lock_records')
             
-            # Get current record
-            current_record = await container.read_item(item=record_id, partition_key=loan_application_id)
-            
-            # Update fields
-            current_record['status'] = status
-            current_record['updated_at'] = datetime.utcnow().isoformat()
-            
+            fields = {'status': status, 'updated_at': datetime.utcnow().isoformat()}
             if updates:
-                current_record.update(updates)
+                fields.update(updates)
             
-            # Replace the item
-            await container.replace_item(item=record_id, body=current_record)
+            if len(fields) <= self.MAX_PATCH_OPERATIONS:
+                # Partial update in a single round-trip, without reading the record first
+                patch_operations = [{"op": "set", "path": f"/{key}", "value": value} for key, value in fields.items()]
+                await container.patch_item(item=record_id, partition_key=loan_application_id,
+                                           patch_operations=patch_operations)
+            else:
+                # Too many fields for one patch request: fall back to read + replace
+                current_record = await container.read_item(item=record_id, partition_key=loan_application_id)
+                current_record.update(fields)
+                await container.replace_item(item=record_id, body=current_record)
             
             console_info(f"Rate lock record updated: {record_id} -> {status}", "CosmosDBOps")
             console_telemetry_event("rate_lock_updated", {
@@ -230,21 +257,7 @@ class CosmosDBOperations:
         try:
             container = await self._get_container('audit_logs')
             
-            audit_date = datetime.utcnow().strftime('%Y-%m-%d')  # Partition key format
-            
-            # Ensure required fields
-            log_entry = {
-                'id': f"audit_{datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}",
-                'auditDate': audit_date,  # Partition key
-                'timestamp': datetime.utcnow().isoformat(),
-                'agentName': audit_data.get('agent_name', 'Unknown'),
-                'loanApplicationId': audit_data.get('loan_application_id'),
-                'eventType': audit_data.get('event_type', 'UNKNOWN'),
-                'action': audit_data.get('action'),
-                'outcome': audit_data.get('outcome'),
-                'details': audit_data.get('details', {}),
-                'ttl': int((datetime.utcnow() + timedelta(days=30)).timestamp())  # Auto-delete after 30 days
-            }
+            log_entry = self._build_audit_log_entry(AuditRecord.from_dict(audit_data))
             
             await container.create_item(body=log_entry)
             
@@ -261,6 +274,85 @@ class CosmosDBOperations:
             console_error(f"Failed to create audit log: {e}", "CosmosDBOps")
             return False
 
+    async def create_audit_logs_batch(self, audit_entries: List[AuditRecord]) -> List[AuditRecord]:
+        """
+        Create many audit log entries using transactional batches.
+        
+        Entries are grouped by their auditDate partition key and written in chunks of at
+        most MAX_BATCH_OPERATIONS, so N entries cost roughly N/100 round-trips instead of N.
+        
+        Args:
+            audit_entries (List[AuditRecord]): Audit records to write
+            
+        Returns:
+            List[AuditRecord]: Records that could not be written (empty if all succeeded)
+        """
+        if not audit_entries:
+            return []
+        
+        try:
+            container = await self._get_container('audit_logs')
+        except Exception as e:
+            console_error(f"Failed to create audit log batch: {e}", "CosmosDBOps")
+            return list(audit_entries)
+        
+        # One clock read per batch; entries flushed together share the write time
+        now = datetime.utcnow()
+        
+        # A transactional batch is scoped to a single partition key value
+        entries_by_partition: Dict[str, List[tuple]] = {}
+        for record in audit_entries:
+            log_entry = self._build_audit_log_entry(record, now)
+            entries_by_partition.setdefault(log_entry['auditDate'], []).append((record, log_entry))
+        
+        failed_entries = []
+        for audit_date, log_entries in entries_by_partition.items():
+            for start in range(0, len(log_entries), self.MAX_BATCH_OPERATIONS):
+                chunk = log_entries[start:start + self.MAX_BATCH_OPERATIONS]
+                try:
+                    await container.execute_item_batch(
+                        batch_operations=[("create", (log_entry,)) for _, log_entry in chunk],
+                        partition_key=audit_date
+                    )
+                except Exception as e:
+                    console_error(f"Failed to write audit log batch of {len(chunk)} entries for {audit_date}: {e}", "CosmosDBOps")
+                    failed_entries.extend(record for record, _ in chunk)
+        
+        written = len(audit_entries) - len(failed_entries)
+        console_debug(f"Audit log batch written: {written}/{len(audit_entries)} entries", "CosmosDBOps")
+        console_telemetry_event("audit_log_batch_created", {
+            "entries": len(audit_entries),
+            "written": written,
+            "partitions": len(entries_by_partition)
+        }, "CosmosDBOps")
+        
+        return failed_entries
+
+    def _build_audit_log_entry(self, record: AuditRecord, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Build the Cosmos DB document for an audit log entry.
+        
+        Args:
+            record (AuditRecord): Audit record to store
+            now (datetime, optional): Write time shared by a whole batch; read from the clock if omitted
+        """
+        now = now or datetime.utcnow()
+        now_iso = now.isoformat()
+        
+        # Ensure required fields
+        return {
+            'id': f"{self._audit_id_prefix}_{next(self._audit_id_counter)}",
+            'auditDate': now_iso[:10],  # Partition key (YYYY-MM-DD)
+            'timestamp': record.timestamp or now_iso,  # Prefer the event's own time
+            'agentName': record.agent_name,
+            'loanApplicationId': record.loan_application_id,
+            'eventType': record.event_type,
+            'action': record.action,
+            'outcome': record.outcome,
+            'details': record.details,
+            'ttl': AUDIT_LOG_TTL_SECONDS  # Auto-delete after 30 days
+        }
+
     async def get_audit_logs(self, loan_application_id: str = None, agent_name: str = None, 
                             start_date: str = None, end_date: str = None, limit: int = 100) -> List[Dict[str, Any]]:
         """
@@ -279,9 +371,9 @@ class CosmosDBOperations:
         try:
             container = await self._get_container('audit_logs')
             
-            # Build query
-            query_parts = ["SELECT * FROM c WHERE 1=1"]
-            parameters = []
+            # Build query; TOP makes the server stop at the limit
+            query_parts = ["SELECT TOP @limit * FROM c WHERE 1=1"]
+            parameters = [{"name": "@limit", "value": limit}]
             
             if loan_application_id:
                 query_parts.append("AND c.loanApplicationId = @loan_app_id")
@@ -302,8 +394,14 @@ class CosmosDBOperations:
             query_parts.append("ORDER BY c.timestamp DESC")
             query = " ".join(query_parts)
             
+            # max_item_count is only the page size, so stream pages and stop at the limit
+            # rather than draining every matching log into memory
             items = container.query_items(query=query, parameters=parameters, max_item_count=limit)
-            logs = [dict(item) async for item in items]
+            logs = []
+            async for item in items:
+                logs.append(dict(item))
+                if len(logs) >= limit:
+                    break
             
             console_info(f"Retrieved {len(logs)} audit log entries", "CosmosDBOps")
             return logs
@@ -327,23 +425,8 @@ class CosmosDBOperations:
         try:
             container = await self._get_container('exceptions')
             
-            exception_id = f"exc_{datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}"
-            
-            # Ensure required fields
-            exception_record = {
-                'id': exception_id,
-                'priority': priority.lower(),  # Partition key
-                'status': 'open',
-                'created': datetime.utcnow().isoformat(),
-                'loanApplicationId': exception_data.get('loan_application_id'),
-                'exceptionType': exception_data.get('exception_type'),
-                'agentName': exception_data.get('agent_name'),
-                'description': exception_data.get('description'),
-                'context': exception_data.get('context', {}),
-                'assignee': exception_data.get('assignee'),
-                'estimatedResolutionTime': exception_data.get('estimated_resolution_time'),
-                'ttl': int((datetime.utcnow() + timedelta(days=90)).timestamp())  # Auto-delete after 90 days
-            }
+            exception_record = self._build_exception_record(priority, exception_data)
+            exception_id = exception_record['id']
             
             await container.create_item(body=exception_record)
             
@@ -361,6 +444,87 @@ class CosmosDBOperations:
             console_error(f"Failed to create exception: {e}", "CosmosDBOps")
             return None
 
+    async def create_exceptions_batch(self, exceptions: List[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Create many exception records using transactional batches.
+        
+        Records are grouped by their priority partition key and written in chunks of at
+        most MAX_BATCH_OPERATIONS.
+        
+        Args:
+            exceptions (List[Tuple[str, Dict[str, Any]]]): (priority, exception_data) pairs, as taken by create_exception
+            
+        Returns:
+            List[Tuple[str, Dict[str, Any]]]: Pairs that could not be written (empty if all succeeded)
+        """
+        if not exceptions:
+            return []
+        
+        try:
+            container = await self._get_container('exceptions')
+        except Exception as e:
+            console_error(f"Failed to create exception batch: {e}", "CosmosDBOps")
+            return list(exceptions)
+        
+        # One clock read per batch; records flushed together share the creation time
+        now = datetime.utcnow()
+        
+        # A transactional batch is scoped to a single partition key value
+        records_by_partition: Dict[str, List[tuple]] = {}
+        for priority, exception_data in exceptions:
+            exception_record = self._build_exception_record(priority, exception_data, now)
+            records_by_partition.setdefault(exception_record['priority'], []).append(((priority, exception_data), exception_record))
+        
+        failed_exceptions = []
+        for partition_priority, records in records_by_partition.items():
+            for start in range(0, len(records), self.MAX_BATCH_OPERATIONS):
+                chunk = records[start:start + self.MAX_BATCH_OPERATIONS]
+                try:
+                    await container.execute_item_batch(
+                        batch_operations=[("create", (exception_record,)) for _, exception_record in chunk],
+                        partition_key=partition_priority
+                    )
+                except Exception as e:
+                    console_error(f"Failed to write exception batch of {len(chunk)} records for priority {partition_priority}: {e}", "CosmosDBOps")
+                    failed_exceptions.extend(entry for entry, _ in chunk)
+        
+        written = len(exceptions) - len(failed_exceptions)
+        console_info(f"Exception batch written: {written}/{len(exceptions)} records", "CosmosDBOps")
+        console_telemetry_event("exception_batch_created", {
+            "exceptions": len(exceptions),
+            "written": written,
+            "partitions": len(records_by_partition)
+        }, "CosmosDBOps")
+        
+        return failed_exceptions
+
+    def _build_exception_record(self, priority: str, exception_data: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Build the Cosmos DB document for an exception record.
+        
+        Args:
+            priority (str): Exception priority (high, medium, low)
+            exception_data (Dict[str, Any]): Exception details
+            now (datetime, optional): Creation time shared by a whole batch; read from the clock if omitted
+        """
+        now = now or datetime.utcnow()
+        
+        # Ensure required fields
+        return {
+            'id': f"{self._exception_id_prefix}_{next(self._exception_id_counter)}",
+            'priority': priority.lower(),  # Partition key
+            'status': 'open',
+            'created': now.isoformat(),
+            'loanApplicationId': exception_data.get('loan_application_id'),
+            'exceptionType': exception_data.get('exception_type'),
+            'agentName': exception_data.get('agent_name'),
+            'description': exception_data.get('description'),
+            'context': exception_data.get('context', {}),
+            'assignee': exception_data.get('assignee'),
+            'estimatedResolutionTime': exception_data.get('estimated_resolution_time'),
+            'ttl': EXCEPTION_TTL_SECONDS  # Auto-delete after 90 days
+        }
+
     async def update_exception_status(self, exception_id: str, priority: str, status: str, 
                                     assignee: str = None, resolution_notes: str = None) -> bool:
         """
@@ -382,9 +546,10 @@ class CosmosDBOperations:
             # Get current record
             current_record = await container.read_item(item=exception_id, partition_key=priority)
             
-            # Update fields
+            # Update fields; one clock read so 'updated' and 'resolvedAt' agree
+            now_iso = datetime.utcnow().isoformat()
             current_record['status'] = status
-            current_record['updated'] = datetime.utcnow().isoformat()
+            current_record['updated'] = now_iso
             
             if assignee:
                 current_record['assignee'] = assignee
@@ -393,7 +558,7 @@ class CosmosDBOperations:
                 current_record['resolutionNotes'] = resolution_notes
             
             if status == 'resolved':
-                current_record['resolvedAt'] = datetime.utcnow().isoformat()
+                current_record['resolvedAt'] = now_iso
             
             # Replace the item
             await container.replace_item(item=exception_id, body=current_record)
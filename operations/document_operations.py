@@ -4,10 +4,42 @@ This module simulates generating documents.
 """
 
 import asyncio
+import base64
+import itertools
+import time
 from typing import Dict, Any
 from datetime import datetime
 from utils.logger import console_info
 
+# Document ids: a per-process prefix plus a counter, so two documents generated
+# in the same second no longer collide
+_DOCUMENT_ID_PREFIX = f"DOC-LC-{int(time.time())}"
+_document_id_counter = itertools.count(1)
+
+# Static text of the rate lock confirmation; only the per-lock fields are filled in per document
+_LOCK_CONFIRMATION_TMPL = """\
+-----------------------------------------
+RATE LOCK CONFIRMATION
+-----------------------------------------
+Date: {date}
+
+Loan Application ID: {loan_id}
+Borrower: {borrower_name}
+
+Your rate has been successfully locked with the following terms:
+
+- Interest Rate: {interest_rate}%
+- Lock Period: {lock_period_days} days
+- Lock Expiration Date: {lock_expiration_date}
+- Product: {product_description}
+
+This confirmation is a legally binding agreement.
+
+Confirmation ID: {confirmation_id}
+Document ID: {document_id}
+-----------------------------------------"""
+
+
 class DocumentOperations:
     """
     A mock class that simulates generating documents.
@@ -28,42 +60,38 @@ class DocumentOperations:
             A dictionary representing the generated document.
         """
         loan_id = loan_data.get('loan_application_id', 'Unknown')
+        # Resolve the nested borrower record once, without allocating throwaway default dicts
+        borrower_info = (loan_data.get('los_data') or {}).get('borrower_info') or {}
         console_info(f"Generating lock confirmation document for loan '{loan_id}'...", self.agent_name)
         
         # Simulate processing time
         await asyncio.sleep(0.5)
         
-        document_id = f"DOC-LC-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-        
-        content = f"""
-        -----------------------------------------
-        RATE LOCK CONFIRMATION
-        -----------------------------------------
-        Date: {datetime.utcnow().strftime('%Y-%m-%d')}
-        
-        Loan Application ID: {loan_id}
-        Borrower: {loan_data.get('los_data', {}).get('borrower_info', {}).get('name', 'N/A')}
-        
-        Your rate has been successfully locked with the following terms:
+        # One clock read per document, so the printed date and created_at always agree
+        now = datetime.utcnow()
+        document_id = f"{_DOCUMENT_ID_PREFIX}-{next(_document_id_counter):06d}"
         
-        - Interest Rate: {lock_details.get('interest_rate')}%
-        - Lock Period: {lock_details.get('lock_period_days')} days
-        - Lock Expiration Date: {lock_details.get('lock_expiration_date')}
-        - Product: {lock_details.get('product_description', 'N/A')}
-        
-        This confirmation is a legally binding agreement.
-        
-        Confirmation ID: {lock_details.get('confirmation_id')}
-        Document ID: {document_id}
-        -----------------------------------------
-        """
+        content = _LOCK_CONFIRMATION_TMPL.format(
+            date=now.date().isoformat(),
+            loan_id=loan_id,
+            borrower_name=borrower_info.get('name', 'N/A'),
+            interest_rate=lock_details.get('interest_rate'),
+            lock_period_days=lock_details.get('lock_period_days'),
+            lock_expiration_date=lock_details.get('lock_expiration_date'),
+            product_description=lock_details.get('product_description', 'N/A'),
+            confirmation_id=lock_details.get('confirmation_id'),
+            document_id=document_id
+        )
         
+        # Encoded once here, in the form the email attachment needs, so the send path never re-encodes it
         document = {
             "document_id": document_id,
             "document_type": "RateLockConfirmation",
-            "content": content.strip(),
+            "content": content,
+            "content_base64": base64.b64encode(content.encode("utf-8")).decode("ascii"),
+            "filename": f"RateLockConfirmation_{loan_id}.txt",
             "format": "text",
-            "created_at": datetime.utcnow().isoformat()
+            "created_at": now.isoformat()
         }
         
         console_info(f"Successfully generated document '{document_id}' for loan '{loan_id}'.", self.agent_name)
@@ -72,7 +100,6 @@ class DocumentOperations:
     async def close(self):
         """Clean up resources (no-op for mock)."""
         console_info("Document Operations resources closed (mock).", self.agent_name)
-        await asyncio.sleep(0)
 
 # Singleton instance
 document_operations = DocumentOperations()
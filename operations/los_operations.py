@@ -69,7 +69,6 @@ class LOSOperations:
     async def close(self):
         """Clean up resources (no-op for mock)."""
         console_info("LOS Operations resources closed (mock).", self.agent_name)
-        await asyncio.sleep(0)
 
 # Singleton instance
 los_operations = LOSOperations()
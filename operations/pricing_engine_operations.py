@@ -4,11 +4,36 @@ This module simulates interactions with a mortgage pricing engine like Optimal B
 """
 
 import asyncio
-import random
-from typing import Dict, Any, List
+import itertools
+import os
+import time
+from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
 from utils.logger import console_info, console_error
 
+# Quote ids: a per-process prefix plus a counter; random five-digit ids could repeat
+_QUOTE_ID_PREFIX = f"Q-{int(time.time())}"
+_quote_id_counter = itertools.count(1)
+
+# (rate offset, base points) for each quoted option; fixed, so computed once rather than per quote
+_RATE_TIERS = tuple((i * 0.125, 1.5 - i * 0.5) for i in range(3))
+
+# Amortization term used for every quoted product (30-year fixed)
+_TERM_IN_MONTHS = 360
+
+
+def _calculate_monthly_payment(principal: float, annual_rate: float) -> float:
+    """Calculates the monthly mortgage payment."""
+    # Non-positive rates return here, so the formula below never divides by a zero growth term
+    if principal <= 0 or annual_rate <= 0:
+        return 0.0
+        
+    monthly_rate = annual_rate / 1200
+    growth = (1 + monthly_rate) ** _TERM_IN_MONTHS
+    payment = principal * (monthly_rate * growth) / (growth - 1)
+    return round(payment, 2)
+
+
 class PricingEngineOperations:
     """
     A mock class that simulates fetching rate quotes from a pricing engine.
@@ -16,6 +41,11 @@ class PricingEngineOperations:
     
     def __init__(self):
         self.agent_name = "pricing_engine_operations"
+        # Caps requests in flight to the (rate-limited) pricing engine; held only around the network call.
+        # Created on first request inside the running loop, since this singleton is built at import time
+        self._max_concurrent_requests = int(os.getenv('PRICING_ENGINE_CONCURRENCY', '8'))
+        self._request_slots: Optional[asyncio.Semaphore] = None
+        self._request_slots_loop = None
 
     async def get_rate_quotes(self, loan_context: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
@@ -29,8 +59,14 @@ class PricingEngineOperations:
         """
         console_info(f"Fetching rate quotes for loan '{loan_context.get('loan_id')}'...", self.agent_name)
         
+        loop = asyncio.get_running_loop()
+        if self._request_slots is None or self._request_slots_loop is not loop:
+            self._request_slots = asyncio.Semaphore(self._max_concurrent_requests)
+            self._request_slots_loop = loop
+        
         # Simulate network delay
-        await asyncio.sleep(1.5)
+        async with self._request_slots:
+            await asyncio.sleep(1.5)
         
         try:
             credit_score = loan_context.get("borrower_credit_score", 700)
@@ -41,19 +77,25 @@ class PricingEngineOperations:
             rate_adjustment = (780 - credit_score) / 100 + (ltv - 80) / 20
             final_base_rate = base_rate + rate_adjustment
             
+            # These are the same for every option, so look them up once
+            loan_amount = loan_context.get("loan_amount", 0)
+            lock_period_days = loan_context.get("requested_lock_period", 30)
+            expires_at = (datetime.utcnow() + timedelta(hours=4)).isoformat()
+            points_adjustment = rate_adjustment / 4
+            
             quotes = []
-            for i in range(3):
-                rate = final_base_rate + (i * 0.125)
-                points = 1.5 - (i * 0.5) - (rate_adjustment / 4)
+            for rate_offset, base_points in _RATE_TIERS:
+                rate = final_base_rate + rate_offset
+                points = base_points - points_adjustment
                 
                 quotes.append({
-                    "quote_id": f"Q-{random.randint(10000, 99999)}",
+                    "quote_id": f"{_QUOTE_ID_PREFIX}-{next(_quote_id_counter):06d}",
                     "interest_rate": round(rate, 3),
                     "points": round(points, 3),
-                    "lock_period_days": loan_context.get("requested_lock_period", 30),
-                    "monthly_payment": self._calculate_monthly_payment(loan_context.get("loan_amount", 0), rate),
+                    "lock_period_days": lock_period_days,
+                    "monthly_payment": _calculate_monthly_payment(loan_amount, rate),
                     "apr": round(rate + (points / 5), 3), # Simplified APR calculation
-                    "expires_at": (datetime.utcnow() + timedelta(hours=4)).isoformat()
+                    "expires_at": expires_at
                 })
             
             console_info(f"Generated {len(quotes)} rate quotes.", self.agent_name)
@@ -63,24 +105,9 @@ class PricingEngineOperations:
             console_error(f"Failed to generate rate quotes: {e}", self.agent_name)
             return []
 
-    def _calculate_monthly_payment(self, principal: float, annual_rate: float) -> float:
-        """Calculates the monthly mortgage payment."""
-        if principal <= 0 or annual_rate <= 0:
-            return 0.0
-            
-        monthly_rate = (annual_rate / 100) / 12
-        term_in_months = 360 # Assuming 30-year fixed
-        
-        if monthly_rate == 0:
-            return principal / term_in_months
-            
-        payment = principal * (monthly_rate * (1 + monthly_rate)**term_in_months) / ((1 + monthly_rate)**term_in_months - 1)
-        return round(payment, 2)
-
     async def close(self):
         """Clean up resources (no-op for mock)."""
         console_info("Pricing Engine Operations resources closed (mock).", self.agent_name)
-        await asyncio.sleep(0)
 
 # Singleton instance
 pricing_engine_operations = PricingEngineOperations()
@@ -4,11 +4,13 @@ Handles all interactions with Azure Service Bus for messaging.
 """
 
 import os
+import re
 import json
+import orjson
 import email
 from email import policy
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
 import asyncio
 from azure.servicebus.aio import ServiceBusClient
 from azure.servicebus import ServiceBusMessage
@@ -16,16 +18,50 @@ from azure.identity.aio import DefaultAzureCredential
 from utils.logger import console_info, console_debug, console_warning, console_error, console_telemetry_event
 from config.azure_config import AzureConfig
 
+# Common email headers used by _looks_like_email, matched case-insensitively in a single scan
+_EMAIL_HEADER_INDICATORS = (
+    'From:', 'To:', 'Subject:', 'Date:',
+    'Message-ID:', 'Return-Path:', 'Received:',
+    'Content-Type:', 'MIME-Version:'
+)
+_EMAIL_HEADER_RE = re.compile('|'.join(re.escape(header) for header in _EMAIL_HEADER_INDICATORS), re.IGNORECASE)
+
+# Plain-text body of the messages sent by send_exception_alert
+_EXCEPTION_ALERT_TMPL = (
+    "Exception Alert: {exception_type}\n"
+    "Priority: {priority}\n"
+    "Loan ID: {loan_application_id}\n"
+    "Details: {exception_data}\n"
+    "Timestamp: {timestamp}"
+)
+
+
+def _join_body_parts(body_parts) -> str:
+    """Join the sections of a Service Bus message body into one string."""
+    if all(isinstance(part, bytes) for part in body_parts):
+        # Join the raw bytes and decode once, rather than decoding each section;
+        # this also keeps multi-byte characters intact across section boundaries
+        return b''.join(body_parts).decode('utf-8')
+    return ''.join(part.decode('utf-8') if isinstance(part, bytes) else str(part) for part in body_parts)
+
+
 class ServiceBusOperations:
+    # Upper bound on one send (connect + transfer); a hung namespace fails the send instead of stalling the agent
+    SEND_TIMEOUT_SECONDS = 10
+    # Sends allowed in flight at once across all agents sharing this instance
+    MAX_CONCURRENT_SENDS = 32
+
     def __init__(self):
         """
         Initialize the ServiceBusOperations class.
         """
+        # Created on first send inside the running loop; this instance is built at import time
+        self._send_slots: Optional[asyncio.Semaphore] = None
+        self._send_slots_loop = None
         self.azure_config = AzureConfig()
         self.servicebus_namespace = self.azure_config.get_servicebus_namespace()
-        self.credential = None
+        self.credential = None  # Shared by every client; created on first use
         self.client = None
-        self._active_credentials = []  # Track active credentials for cleanup
         
         # Load topic and queue names from Azure configuration
         self.queues = {
@@ -119,54 +155,83 @@ class ServiceBusOperations:
         if not content or len(content) < 50:
             return False
         
-        # Check for common email headers
-        email_indicators = [
-            'From:', 'To:', 'Subject:', 'Date:',
-            'Message-ID:', 'Return-Path:', 'Received:',
-            'Content-Type:', 'MIME-Version:'
-        ]
+        # One pass over the content for all headers, without a lowercased copy;
+        # stop as soon as three distinct headers have been seen
+        headers_found = set()
+        for match in _EMAIL_HEADER_RE.finditer(content):
+            headers_found.add(match.group().lower())
+            # If we find at least 3 email headers, it's likely an email
+            if len(headers_found) >= 3:
+                return True
         
-        # Convert to lowercase for case-insensitive matching
-        content_lower = content.lower()
-        
-        # Count how many email indicators we find
-        indicator_count = sum(1 for indicator in email_indicators 
-                            if indicator.lower() in content_lower)
-        
-        # If we find at least 3 email headers, it's likely an email
-        return indicator_count >= 3
+        return False
 
     async def _get_servicebus_client(self):
         """
-        Get or create Service Bus client with proper authentication.
+        Create a Service Bus client with proper authentication.
         Creates a new client instance each time to avoid connection issues.
-        Returns both the client and credential for proper cleanup.
+        All clients share one credential, so its token cache survives between
+        operations; it is closed by cleanup_all_credentials.
         """
         try:
             if not self.servicebus_namespace:
                 raise ValueError("AZURE_SERVICEBUS_NAMESPACE_NAME environment variable is required")
             
-            # Always create a fresh credential and client for each operation
-            # This avoids the connection handler issues we were seeing
-            credential = DefaultAzureCredential()
-            self._active_credentials.append(credential)  # Track for cleanup
+            # Fresh client for each operation avoids the connection handler issues we were seeing,
+            # but the credential is reused so each operation doesn't have to fetch a new token
+            if self.credential is None:
+                self.credential = DefaultAzureCredential()
             fully_qualified_namespace = f"{self.servicebus_namespace}.servicebus.windows.net"
-            client = ServiceBusClient(fully_qualified_namespace, credential)
+            client = ServiceBusClient(fully_qualified_namespace, self.credential)
             
             console_debug("Service Bus client created successfully", "ServiceBusOps")
-            return client, credential
+            return client
             
         except Exception as e:
             console_error(f"Failed to create Service Bus client: {e}", "ServiceBusOps")
             raise
 
-    async def send_message(self, destination_name: str, message_body: str, correlation_id: Optional[str] = None, destination_type: str = 'topic') -> bool:
+    def _get_sender(self, client, destination_name: str, destination_type: str):
+        """
+        Resolve a logical topic or queue name and create a sender for it.
+        
+        Returns:
+            tuple: The sender and the actual destination name.
+        """
+        if destination_type == 'topic':
+            actual_destination_name = self.topics.get(destination_name)
+            if not actual_destination_name:
+                raise ValueError(f"Topic '{destination_name}' not found in configuration.")
+            return client.get_topic_sender(topic_name=actual_destination_name), actual_destination_name
+        if destination_type == 'queue':
+            actual_destination_name = self.queues.get(destination_name)
+            if not actual_destination_name:
+                raise ValueError(f"Queue '{destination_name}' not found in configuration.")
+            return client.get_queue_sender(queue_name=actual_destination_name), actual_destination_name
+        raise ValueError(f"Invalid destination_type: {destination_type}. Use 'topic' or 'queue'.")
+
+    async def _bounded_send(self, send_coro):
+        """
+        Run a send while holding one of the concurrent send slots, giving up after SEND_TIMEOUT_SECONDS.
+        
+        Raises:
+            asyncio.TimeoutError: If the send did not finish in time
+        """
+        loop = asyncio.get_running_loop()
+        if self._send_slots is None or self._send_slots_loop is not loop:
+            # A semaphore is bound to the loop it is first used on, so a new loop (asyncio.run restart) gets a new one
+            self._send_slots = asyncio.Semaphore(self.MAX_CONCURRENT_SENDS)
+            self._send_slots_loop = loop
+        async with self._send_slots:
+            await asyncio.wait_for(send_coro, timeout=self.SEND_TIMEOUT_SECONDS)
+
+    async def send_message(self, destination_name: str, message_body: Union[str, bytes], correlation_id: Optional[str] = None, destination_type: str = 'topic') -> bool:
         """
         Send a message to a specific Service Bus topic or queue.
         
         Args:
             destination_name (str): The logical name of the topic or queue to send the message to.
-            message_body (str): The message payload as raw text.
+            message_body (Union[str, bytes]): The message payload as raw text or UTF-8 encoded bytes.
             correlation_id (str, optional): A correlation ID for tracking.
             destination_type (str): Either 'topic' or 'queue'
             
@@ -174,40 +239,20 @@ class ServiceBusOperations:
             bool: True if successful, False otherwise.
         """
         try:
-            client, credential = await self._get_servicebus_client()
-            
-            if destination_type == 'topic':
-                actual_destination_name = self.topics.get(destination_name)
-                if not actual_destination_name:
-                    raise ValueError(f"Topic '{destination_name}' not found in configuration.")
-                sender_method = client.get_topic_sender
-            elif destination_type == 'queue':
-                actual_destination_name = self.queues.get(destination_name)
-                if not actual_destination_name:
-                    raise ValueError(f"Queue '{destination_name}' not found in configuration.")
-                sender_method = client.get_queue_sender
-            else:
-                raise ValueError(f"Invalid destination_type: {destination_type}. Use 'topic' or 'queue'.")
-
-            if destination_type == 'topic':
-                sender = sender_method(topic_name=actual_destination_name)
-            else:
-                sender = sender_method(queue_name=actual_destination_name)
-                
-            async with client, sender:
-                # Send raw string content directly
-                message_to_send = ServiceBusMessage(
-                    body=message_body,
-                    content_type="text/plain",
-                    correlation_id=correlation_id
-                )
-                await sender.send_messages(message_to_send)
-            
-            # Explicitly close the credential to clean up HTTP sessions
-            await credential.close()
-            # Remove from active tracking
-            if credential in self._active_credentials:
-                self._active_credentials.remove(credential)
+            client = await self._get_servicebus_client()
+            sender, actual_destination_name = self._get_sender(client, destination_name, destination_type)
+            
+            async def send():
+                async with client, sender:
+                    # Send raw string content directly
+                    message_to_send = ServiceBusMessage(
+                        body=message_body,
+                        content_type="text/plain",
+                        correlation_id=correlation_id
+                    )
+                    await sender.send_messages(message_to_send)
+            
+            await self._bounded_send(send())
             
             console_info(f"Message sent to {destination_type} '{actual_destination_name}'", "ServiceBusOps")
             console_telemetry_event("message_sent", {
@@ -219,10 +264,75 @@ class ServiceBusOperations:
             
             return True
 
+        except asyncio.TimeoutError:
+            console_error(f"Timed out after {self.SEND_TIMEOUT_SECONDS}s sending message to {destination_type} '{destination_name}'", "ServiceBusOps")
+            return False
         except Exception as e:
             console_error(f"Failed to send message to {destination_type} '{destination_name}': {e}", "ServiceBusOps")
             return False
 
+    async def send_messages_batch(self, destination_name: str, message_bodies: List[Union[str, bytes]], correlation_id: Optional[str] = None, destination_type: str = 'topic',
+                                  correlation_ids: Optional[List[Optional[str]]] = None) -> bool:
+        """
+        Send several messages to one Service Bus topic or queue over a single connection.
+        Messages are packed into as few AMQP batches as the size limit allows.
+        
+        Args:
+            destination_name (str): The logical name of the topic or queue to send the messages to.
+            message_bodies (List[Union[str, bytes]]): The message payloads as raw text or UTF-8 encoded bytes.
+            correlation_id (str, optional): A correlation ID applied to every message.
+            destination_type (str): Either 'topic' or 'queue'
+            correlation_ids (List[str], optional): Per-message correlation IDs, overriding correlation_id.
+            
+        Returns:
+            bool: True if every message was sent, False otherwise.
+        """
+        if not message_bodies:
+            return True
+        
+        try:
+            client = await self._get_servicebus_client()
+            sender, actual_destination_name = self._get_sender(client, destination_name, destination_type)
+            if correlation_ids is None:
+                correlation_ids = [correlation_id] * len(message_bodies)
+            
+            async def send():
+                async with client, sender:
+                    batch = await sender.create_message_batch()
+                    for message_body, message_correlation_id in zip(message_bodies, correlation_ids):
+                        message_to_send = ServiceBusMessage(
+                            body=message_body,
+                            content_type="text/plain",
+                            correlation_id=message_correlation_id
+                        )
+                        try:
+                            batch.add_message(message_to_send)
+                        except ValueError:
+                            # Batch is full: send it and start the next one with this message
+                            await sender.send_messages(batch)
+                            batch = await sender.create_message_batch()
+                            batch.add_message(message_to_send)
+                    await sender.send_messages(batch)
+            
+            await self._bounded_send(send())
+            
+            console_info(f"{len(message_bodies)} messages sent to {destination_type} '{actual_destination_name}'", "ServiceBusOps")
+            console_telemetry_event("message_batch_sent", {
+                "destination": actual_destination_name,
+                "destination_type": destination_type,
+                "correlation_id": correlation_id,
+                "message_count": len(message_bodies)
+            }, "ServiceBusOps")
+            
+            return True
+
+        except asyncio.TimeoutError:
+            console_error(f"Timed out after {self.SEND_TIMEOUT_SECONDS}s sending message batch to {destination_type} '{destination_name}'", "ServiceBusOps")
+            return False
+        except Exception as e:
+            console_error(f"Failed to send message batch to {destination_type} '{destination_name}': {e}", "ServiceBusOps")
+            return False
+
     async def receive_messages(self, topic_name: str, subscription_name: str, max_wait_time: int = 5) -> List[Dict[str, Any]]:
         """
         Receive messages from a Service Bus topic subscription.
@@ -236,7 +346,7 @@ class ServiceBusOperations:
             List of received messages as dictionaries
         """
         try:
-            client, credential = await self._get_servicebus_client()
+            client = await self._get_servicebus_client()
             
             # Check if topic_name is a logical name in our mapping, otherwise use as-is
             actual_topic_name = self.topics.get(topic_name, topic_name)
@@ -269,7 +379,7 @@ class ServiceBusOperations:
                                 try:
                                     # Convert generator to actual content
                                     body_parts = list(msg.body)
-                                    body_str = ''.join(part.decode('utf-8') if isinstance(part, bytes) else str(part) for part in body_parts)
+                                    body_str = _join_body_parts(body_parts)
                                 except Exception as e:
                                     console_warning(f"Failed to extract body from generator: {e}, falling back to str()", "ServiceBusOps")
                                     body_str = str(msg.body)
@@ -313,22 +423,10 @@ class ServiceBusOperations:
                 if messages:
                     console_info(f"Received {len(messages)} messages from {topic_name}/{subscription_name}", "ServiceBusOps")
                 
-                # Explicitly close the credential to clean up HTTP sessions
-                await credential.close()
-                # Remove from active tracking
-                if credential in self._active_credentials:
-                    self._active_credentials.remove(credential)
                 return messages
             
         except Exception as e:
             console_warning(f"Error receiving messages from {topic_name}/{subscription_name}: {e}", "ServiceBusOps")
-            # Clean up credential even on error
-            try:
-                await credential.close()
-                if credential in self._active_credentials:
-                    self._active_credentials.remove(credential)
-            except:
-                pass
             return []
 
     async def receive_queue_messages(self, queue_name: str, max_wait_time: int = 5) -> List[Dict[str, Any]]:
@@ -343,7 +441,7 @@ class ServiceBusOperations:
             List of received messages as dictionaries
         """
         try:
-            client, credential = await self._get_servicebus_client()
+            client = await self._get_servicebus_client()
             
             # Check if queue_name is a logical name in our mapping, otherwise use as-is
             actual_queue_name = self.queues.get(queue_name, queue_name)
@@ -378,7 +476,7 @@ class ServiceBusOperations:
                                     # Handle generator objects properly
                                     try:
                                         body_parts = list(msg.body)
-                                        body_str = ''.join(part.decode('utf-8') if isinstance(part, bytes) else str(part) for part in body_parts)
+                                        body_str = _join_body_parts(body_parts)
                                         console_debug(f"Message {msg.message_id} extracted from generator, length: {len(body_str)}", "ServiceBusOps")
                                     except Exception as e:
                                         console_warning(f"Failed to extract body from generator: {e}, falling back to str()", "ServiceBusOps")
@@ -424,39 +522,25 @@ class ServiceBusOperations:
                 if messages:
                     console_info(f"Received {len(messages)} messages from queue {queue_name}", "ServiceBusOps")
                 
-                # Explicitly close the credential to clean up HTTP sessions
-                await credential.close()
-                # Remove from active tracking
-                if credential in self._active_credentials:
-                    self._active_credentials.remove(credential)
                 return messages
         
         except Exception as e:
             console_error(f"Error receiving queue messages from {queue_name}: {e}", "ServiceBusOps")
-            # Clean up credential even on error
-            try:
-                await credential.close()
-                if credential in self._active_credentials:
-                    self._active_credentials.remove(credential)
-            except:
-                pass
             return []
 
     async def cleanup_all_credentials(self):
         """
-        Clean up any remaining active credentials to prevent unclosed session warnings.
-        """
-        if self._active_credentials:
-            console_info(f"Cleaning up {len(self._active_credentials)} remaining credentials", "ServiceBusOps")
-            for credential in self._active_credentials.copy():
-                try:
-                    await credential.close()
-                    self._active_credentials.remove(credential)
-                except Exception as e:
-                    console_debug(f"Error closing credential: {e}", "ServiceBusOps")
-            self._active_credentials.clear()
+        Close the shared credential to prevent unclosed session warnings.
+        """
+        if self.credential is not None:
+            credential, self.credential = self.credential, None
+            console_info("Cleaning up shared Service Bus credential", "ServiceBusOps")
+            try:
+                await credential.close()
+            except Exception as e:
+                console_debug(f"Error closing credential: {e}", "ServiceBusOps")
 
-    async def send_exception_alert(self, exception_type: str, priority: str, loan_application_id: str, exception_data: str) -> bool:
+    async def send_exception_alert(self, exception_type: str, priority: str, loan_application_id: str, exception_data: Union[str, Dict[str, Any]]) -> bool:
         """
         Send an exception alert to the exception handling topic.
         
@@ -464,18 +548,23 @@ class ServiceBusOperations:
             exception_type (str): Type of exception
             priority (str): Priority level (high, medium, low)
             loan_application_id (str): Associated loan application ID
-            exception_data (str): Exception details as JSON string
+            exception_data (Union[str, Dict[str, Any]]): Exception details as a dictionary or JSON string
             
         Returns:
             bool: True if successful, False otherwise
         """
         try:
+            if not isinstance(exception_data, str):
+                exception_data = orjson.dumps(exception_data).decode()
+
             # Create exception alert message
-            alert_message = f"""Exception Alert: {exception_type}
-Priority: {priority}
-Loan ID: {loan_application_id}
-Details: {exception_data}
-Timestamp: {datetime.utcnow().isoformat()}"""
+            alert_message = _EXCEPTION_ALERT_TMPL.format(
+                exception_type=exception_type,
+                priority=priority,
+                loan_application_id=loan_application_id,
+                exception_data=exception_data,
+                timestamp=datetime.utcnow().isoformat()
+            )
 
             # Send to exception alerts topic
             return await self.send_message(
@@ -489,58 +578,40 @@ Timestamp: {datetime.utcnow().isoformat()}"""
             console_error(f"Failed to send exception alert: {e}", "ServiceBusOps")
             return False
 
-    async def send_message_to_topic(self, topic_name: str, message_body: str, correlation_id: Optional[str] = None) -> bool:
-        """
-        Send a message to a specific Service Bus topic (alias for send_message with topic type).
-        
-        Args:
-            topic_name (str): The logical name of the topic to send the message to
-            message_body (str): The message payload as raw text
-            correlation_id (str, optional): A correlation ID for tracking
-            
-        Returns:
-            bool: True if successful, False otherwise
-        """
-        return await self.send_message(
-            destination_name=topic_name,
-            message_body=message_body,
-            correlation_id=correlation_id,
-            destination_type="topic"
-        )
-
-    async def send_audit_message(self, agent_name: str, action: str, loan_application_id: str, audit_data: Dict[str, Any]) -> bool:
+    async def send_audit_messages_batch(self, audit_events: List[Dict[str, Any]]) -> bool:
         """
-        Send an audit message to the audit logging topic.
+        Send several audit messages to the audit logging topic in one batch.
         
         Args:
-            agent_name (str): Name of the agent performing the action
-            action (str): Action being performed 
-            loan_application_id (str): Associated loan application ID
-            audit_data (Dict[str, Any]): Audit details as dictionary
+            audit_events (List[Dict[str, Any]]): Events with agent_name, action, loan_application_id,
+                audit_data and timestamp keys, in the same shape send_audit_message produces.
             
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            # Create audit message
-            audit_message = {
-                "agent_name": agent_name,
-                "action": action,
-                "loan_application_id": loan_application_id,
-                "audit_data": audit_data,
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            message_bodies = []
+            correlation_ids = []
+            for event in audit_events:
+                loan_application_id = event.get("loan_application_id") or "unknown"
+                message_bodies.append(orjson.dumps({
+                    "agent_name": event.get("agent_name"),
+                    "action": event.get("action"),
+                    "loan_application_id": loan_application_id,
+                    "audit_data": event.get("audit_data") or {},
+                    "timestamp": event.get("timestamp") or datetime.utcnow().isoformat()
+                }))
+                correlation_ids.append(loan_application_id)
 
-            # Send to audit logging topic
-            return await self.send_message(
+            return await self.send_messages_batch(
                 destination_name="audit_logging",
-                message_body=json.dumps(audit_message),
-                correlation_id=loan_application_id,
-                destination_type="topic"
+                message_bodies=message_bodies,
+                destination_type="topic",
+                correlation_ids=correlation_ids
             )
             
         except Exception as e:
-            console_error(f"Failed to send audit message: {e}", "ServiceBusOps")
+            console_error(f"Failed to send audit message batch: {e}", "ServiceBusOps")
             return False
 
     async def send_audit_log(self, agent_name: str, action: str, loan_application_id: str, audit_data: Dict[str, Any]) -> bool:
@@ -601,10 +672,10 @@ Timestamp: {datetime.utcnow().isoformat()}"""
                 "timestamp": datetime.utcnow().isoformat()
             }
 
-            # Send to audit logging topic
+            # Send to audit logging topic, serialized once straight to the message body bytes
             return await self.send_message(
                 destination_name="audit_logging",
-                message_body=json.dumps(audit_message),
+                message_body=orjson.dumps(audit_message),
                 correlation_id=loan_application_id or "unknown",
                 destination_type="topic"
             )
@@ -3,7 +3,7 @@ Compliance Plugin - MOCK IMPLEMENTATION
 This plugin provides kernel functions for running compliance and risk checks.
 """
 
-import json
+import orjson
 from typing import Annotated, Dict, Any
 from semantic_kernel.functions.kernel_function_decorator import kernel_function
 from operations.compliance_operations import compliance_operations
@@ -53,24 +53,24 @@ class CompliancePlugin:
         self._log_function_call("run_compliance_assessment")
         
         try:
-            loan_data = json.loads(loan_data_json)
+            loan_data = orjson.loads(loan_data_json)
             loan_id = loan_data.get('loan_application_id', 'Unknown Loan')
             self._send_friendly_notification(f"⚖️ Running compliance assessment for loan {loan_id}...")
 
             if not loan_data:
-                return json.dumps({"success": False, "error": "loan_data_json is required."})
+                return orjson.dumps({"success": False, "error": "loan_data_json is required."}).decode()
 
             results = await compliance_operations.run_compliance_check(loan_data)
             
             self._send_friendly_notification(f"✅ Compliance assessment complete. Status: {results.get('overall_status')}")
-            return json.dumps({"success": True, "data": results})
+            return orjson.dumps({"success": True, "data": results}).decode()
 
-        except json.JSONDecodeError:
-            return json.dumps({"success": False, "error": "Invalid JSON format for loan_data_json."})
+        except orjson.JSONDecodeError:
+            return orjson.dumps({"success": False, "error": "Invalid JSON format for loan_data_json."}).decode()
         except Exception as e:
             console_error(f"Error running compliance assessment: {str(e)}", self.agent_name)
             self._send_friendly_notification(f"❌ An error occurred during compliance assessment.")
-            return json.dumps({"success": False, "error": str(e)})
+            return orjson.dumps({"success": False, "error": str(e)}).decode()
 
     async def close(self):
         """Clean up resources."""
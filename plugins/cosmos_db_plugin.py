@@ -2,7 +2,8 @@ from datetime import datetime
 import os
 import asyncio
 import json
-from typing import List, Optional, Annotated, Dict, Any
+import orjson
+from typing import List, Optional, Annotated, Dict, Any, Tuple, Union
 from semantic_kernel import Kernel
 from semantic_kernel.functions import kernel_function
 
@@ -14,6 +15,8 @@ except Exception as e:
     print(f"⚠ Could not import CosmosDBOperations: {e}")
     raise
 
+from models.audit_record import AuditRecord
+
 # Initialize cosmos operations
 cosmos_operations = CosmosDBOperations()
 
@@ -61,7 +64,7 @@ class CosmosDBPlugin:
                               borrower_phone: Annotated[str, "Phone number of the borrower"] = "",
                               property_address: Annotated[str, "Property address for the loan"] = "",
                               requested_lock_period: Annotated[str, "Requested lock period in days"] = "30",
-                              additional_data: Annotated[str, "Additional loan data as JSON string"] = None) -> Annotated[Dict[str, Any], "Returns creation status and record details."]:
+                              additional_data: Annotated[Union[str, Dict[str, Any]], "Additional loan data as a JSON string or dict"] = None) -> Annotated[Dict[str, Any], "Returns creation status and record details."]:
         
         self._log_function_call("create_rate_lock", loan_application_id=loan_application_id, borrower_name=borrower_name)
         self._send_friendly_notification(f"🏠 Creating rate lock record for loan: {loan_application_id}...")
@@ -70,9 +73,11 @@ class CosmosDBPlugin:
             raise ValueError("loan_application_id, borrower_name, and borrower_email are required")
         
         try:
-            # Parse additional data if provided
+            # Parse additional data if provided; in-process callers pass a dict directly
             extra_data = {}
-            if additional_data:
+            if isinstance(additional_data, dict):
+                extra_data = additional_data
+            elif additional_data:
                 try:
                     extra_data = json.loads(additional_data)
                 except json.JSONDecodeError:
@@ -302,8 +307,8 @@ class CosmosDBPlugin:
             detail_data = {}
             if details:
                 try:
-                    detail_data = json.loads(details)
-                except json.JSONDecodeError:
+                    detail_data = orjson.loads(details)
+                except orjson.JSONDecodeError:
                     print(f"⚠ Invalid JSON in details, storing as string: {details}")
                     detail_data = {"raw_details": details}
             
@@ -498,6 +503,54 @@ class CosmosDBPlugin:
             self._send_friendly_notification(f"❌ Error creating exception record")
             return {"success": False, "error": str(e)}
 
+    async def create_audit_logs_batch(self, audit_entries: List[AuditRecord]) -> Dict[str, Any]:
+        """
+        Create a batch of audit logs in as few Cosmos DB round-trips as possible.
+        Not exposed as a kernel function; used by the audit agent's background flusher.
+
+        Args:
+            audit_entries: AuditRecord instances to write
+
+        Returns:
+            Dict with success flag, written count and the records that failed to write
+        """
+        self._log_function_call("create_audit_logs_batch", count=len(audit_entries))
+
+        try:
+            failed_entries = await cosmos_operations.create_audit_logs_batch(audit_entries)
+            return {
+                "success": not failed_entries,
+                "written": len(audit_entries) - len(failed_entries),
+                "failed": failed_entries
+            }
+        except Exception as e:
+            print(f"❌ Error creating audit log batch: {str(e)}")
+            return {"success": False, "written": 0, "failed": list(audit_entries), "error": str(e)}
+
+    async def create_exceptions_batch(self, exceptions: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Create a batch of exception records in as few Cosmos DB round-trips as possible.
+        Not exposed as a kernel function; used by the exception handler's background flusher.
+
+        Args:
+            exceptions: (priority, exception_data) pairs
+
+        Returns:
+            Dict with success flag, written count and the pairs that failed to write
+        """
+        self._log_function_call("create_exceptions_batch", count=len(exceptions))
+
+        try:
+            failed_exceptions = await cosmos_operations.create_exceptions_batch(exceptions)
+            return {
+                "success": not failed_exceptions,
+                "written": len(exceptions) - len(failed_exceptions),
+                "failed": failed_exceptions
+            }
+        except Exception as e:
+            print(f"❌ Error creating exception batch: {str(e)}")
+            return {"success": False, "written": 0, "failed": list(exceptions), "error": str(e)}
+
     async def close(self):
         """
         Clean up resources when the plugin is no longer needed.
@@ -2,7 +2,7 @@ from datetime import datetime
 import os
 import asyncio
 import json
-from typing import List, Optional, Annotated, Dict, Any
+from typing import List, Optional, Annotated, Dict, Any, Union
 from semantic_kernel import Kernel
 from semantic_kernel.functions import kernel_function
 
@@ -129,7 +129,7 @@ class ServiceBusPlugin:
     async def send_audit_message(self, agent_name: Annotated[str, "Name of the agent performing the action"],
                                 action: Annotated[str, "Action being performed (EMAIL_PROCESSED, CONTEXT_RETRIEVED, RATES_GENERATED, COMPLIANCE_CHECKED, LOCK_CONFIRMED, EXCEPTION_ESCALATED)"],
                                 loan_application_id: Annotated[str, "Loan application ID associated with the action"],
-                                audit_data: Annotated[str, "Audit details as JSON string"]) -> Annotated[Dict[str, Any], "Returns audit message sending status."]:
+                                audit_data: Annotated[Union[str, Dict[str, Any]], "Audit details as a dictionary or JSON string"]) -> Annotated[Dict[str, Any], "Returns audit message sending status."]:
         
         self._log_function_call("send_audit_message", agent_name=agent_name, action=action)
         self._send_friendly_notification(f"📋 Sending audit message: {agent_name} - {action}...")
@@ -138,12 +138,15 @@ class ServiceBusPlugin:
             raise ValueError("agent_name, action, loan_application_id, and audit_data are required")
         
         try:
-            # Parse audit data
-            try:
-                data_payload = json.loads(audit_data)
-            except json.JSONDecodeError:
-                print(f"⚠ Invalid JSON in audit_data, wrapping as string: {audit_data}")
-                data_payload = {"raw_data": audit_data}
+            # Dictionaries pass straight through and are serialized once by the operations layer
+            if isinstance(audit_data, dict):
+                data_payload = audit_data
+            else:
+                try:
+                    data_payload = json.loads(audit_data)
+                except json.JSONDecodeError:
+                    print(f"⚠ Invalid JSON in audit_data, wrapping as string: {audit_data}")
+                    data_payload = {"raw_data": audit_data}
             
             # Send message
             success = await servicebus_operations.send_audit_message(
@@ -194,7 +197,7 @@ class ServiceBusPlugin:
     async def send_exception_alert(self, exception_type: Annotated[str, "Type of exception (COMPLIANCE_VIOLATION, TECHNICAL_ERROR, DATA_VALIDATION_FAILURE, SYSTEM_TIMEOUT, MISSING_DOCUMENTATION)"],
                                   priority: Annotated[str, "Priority level (high, medium, low)"],
                                   loan_application_id: Annotated[str, "Loan application ID associated with the exception"],
-                                  exception_data: Annotated[str, "Exception details as JSON string"]) -> Annotated[Dict[str, Any], "Returns exception alert sending status."]:
+                                  exception_data: Annotated[Union[str, Dict[str, Any]], "Exception details as a dictionary or JSON string"]) -> Annotated[Dict[str, Any], "Returns exception alert sending status."]:
         
         self._log_function_call("send_exception_alert", exception_type=exception_type, priority=priority)
         self._send_friendly_notification(f"🚨 Sending {priority} priority exception alert: {exception_type}...")
@@ -203,12 +206,15 @@ class ServiceBusPlugin:
             raise ValueError("exception_type, priority, loan_application_id, and exception_data are required")
         
         try:
-            # Parse exception data
-            try:
-                data_payload = json.loads(exception_data)
-            except json.JSONDecodeError:
-                print(f"⚠ Invalid JSON in exception_data, wrapping as string: {exception_data}")
-                data_payload = {"raw_data": exception_data}
+            # Dictionaries pass straight through and are serialized once by the operations layer
+            if isinstance(exception_data, dict):
+                data_payload = exception_data
+            else:
+                try:
+                    data_payload = json.loads(exception_data)
+                except json.JSONDecodeError:
+                    print(f"⚠ Invalid JSON in exception_data, wrapping as string: {exception_data}")
+                    data_payload = {"raw_data": exception_data}
             
             # Send message
             success = await servicebus_operations.send_exception_alert(
@@ -294,6 +300,85 @@ class ServiceBusPlugin:
             self._send_friendly_notification(f"❌ Error sending message to topic")
             return False
 
+    async def send_messages_batch_to_topic(self, topic_name: str, message_type: str, loan_application_id: str,
+                                          messages_data: List[dict], correlation_id: str = None) -> bool:
+        """
+        Send several messages of the same type to a Service Bus topic in one batch.
+        
+        Args:
+            topic_name (str): Name of the topic to send to
+            message_type (str): Type of message for workflow coordination
+            loan_application_id (str): Loan application ID for tracking
+            messages_data (List[dict]): One data payload per message
+            correlation_id (str, optional): Correlation ID for tracking (defaults to the loan application ID)
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            self._log_function_call("send_messages_batch_to_topic", topic_name=topic_name, message_type=message_type,
+                                    loan_application_id=loan_application_id, message_count=len(messages_data))
+            self._send_friendly_notification(f"📨 Sending {len(messages_data)} messages to topic: {topic_name}...")
+            
+            timestamp = datetime.utcnow().isoformat()
+            message_bodies = [
+                json.dumps({
+                    "message_type": message_type,
+                    "loan_application_id": loan_application_id or "unknown",
+                    "data": message_data,
+                    "timestamp": timestamp
+                })
+                for message_data in messages_data
+            ]
+            
+            success = await servicebus_operations.send_messages_batch(
+                destination_name=topic_name,
+                message_bodies=message_bodies,
+                correlation_id=correlation_id or loan_application_id,
+                destination_type='topic'
+            )
+            
+            if success:
+                self._send_friendly_notification(f"✅ Messages sent to topic successfully")
+            else:
+                self._send_friendly_notification(f"❌ Failed to send messages to topic")
+                
+            return success
+            
+        except Exception as e:
+            print(f"❌ Error sending messages to topic: {str(e)}")
+            self._send_friendly_notification(f"❌ Error sending messages to topic")
+            return False
+
+    async def send_audit_messages_batch(self, audit_events: List[Dict[str, Any]]) -> bool:
+        """
+        Send several audit messages to the audit logging topic in one batch.
+        
+        Args:
+            audit_events (List[Dict[str, Any]]): Events with agent_name, action, loan_application_id,
+                audit_data (dict) and timestamp keys
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        try:
+            self._log_function_call("send_audit_messages_batch", message_count=len(audit_events))
+            self._send_friendly_notification(f"📋 Sending {len(audit_events)} audit messages...")
+            
+            success = await servicebus_operations.send_audit_messages_batch(audit_events)
+            
+            if success:
+                self._send_friendly_notification(f"✅ Audit messages sent successfully")
+            else:
+                self._send_friendly_notification(f"❌ Failed to send audit messages")
+                
+            return success
+            
+        except Exception as e:
+            print(f"❌ Error sending audit messages: {str(e)}")
+            self._send_friendly_notification(f"❌ Error sending audit messages")
+            return False
+
     async def send_message_to_queue(self, queue_name: str, message_body: str = None, correlation_id: str = None, 
                                    message_type: str = None, loan_application_id: str = None, message_data: dict = None) -> bool:
         """
@@ -350,6 +435,8 @@ class ServiceBusPlugin:
     async def close(self):
         """
         Clean up resources when the plugin is no longer needed.
-        Note: ServiceBusOperations uses per-operation clients, so no cleanup needed.
+        Note: every plugin instance shares the module-level ServiceBusOperations and its
+        credential, so the credential is not closed here; other agents may still be sending.
+        It is closed once at system shutdown (see main.py).
         """
         print("Service Bus plugin resources cleaned up")
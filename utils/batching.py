@@ -0,0 +1,119 @@
+"""
+Async Batch Writer
+Buffers items in a bounded asyncio queue and hands them to an async callback in batches.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, List, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Sentinel placed on the queue by aclose() to stop the flush loop after draining
+_STOP = object()
+
+
+class AsyncBatchWriter:
+    """
+    Collects items on a bounded queue and flushes them from a background task.
+
+    A batch is flushed as soon as it reaches ``batch_size`` items or when
+    ``flush_interval`` seconds have passed since its first item arrived.
+    Producers block on ``put`` while the queue is full, which applies
+    backpressure instead of buffering without limit.
+    """
+
+    def __init__(self, flush_callback: Callable[[List[Any]], Awaitable[None]], name: str = "batch_writer",
+                 batch_size: int = 100, flush_interval: float = 0.2, max_queue_size: int = 10_000):
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._flush_callback = flush_callback
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._flusher_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Start the background flusher. Must be called from a running event loop."""
+        if self._flusher_task is None:
+            self._flusher_task = asyncio.create_task(self._flush_loop(), name=f"{self.name}_flusher")
+
+    async def put(self, item: Any):
+        """Queue an item for the next batch, waiting while the queue is full."""
+        await self._queue.put(item)
+
+    def put_nowait(self, item: Any) -> bool:
+        """Queue an item without yielding to the event loop. Returns False if the queue is full."""
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _flush_loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Any]):
+        try:
+            await self._flush_callback(batch)
+        except Exception as e:
+            # Keep the flusher alive; the callback owns error reporting for its items
+            logger.error("%s: Failed to flush batch of %d items - %s", self.name, len(batch), e)
+
+    async def aclose(self):
+        """Flush everything that is still queued and stop the background flusher."""
+        if self._flusher_task is None:
+            return
+
+        await self._queue.put(_STOP)
+        await self._flusher_task
+        self._flusher_task = None
+
+
+async def spill_to_jsonl(path: str, items: List[Any]) -> bool:
+    """
+    Append items that could not be delivered to a local JSONL file so they can be replayed.
+
+    The batch is serialized into one buffer and written off the event loop in a single append.
+    Returns False (after logging) if the file could not be written.
+    """
+    if not items:
+        return True
+    payload = b"".join(orjson.dumps(item, option=orjson.OPT_APPEND_NEWLINE) for item in items)
+    try:
+        await asyncio.to_thread(_append_to_file, path, payload)
+        return True
+    except OSError as e:
+        logger.critical("FATAL: Could not save %d undelivered items to %s. Error: %s", len(items), path, e)
+        return False
+
+
+def _append_to_file(path: str, payload: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "ab") as spill_file:
+        spill_file.write(payload)
@@ -3,8 +3,12 @@ Unified Logging System
 All logging goes through Python's logging module for both console and file output.
 """
 import logging
+from functools import lru_cache
 
 # Get the root logger to ensure we use the same configuration as main.py
+# Cached: module names are a small fixed set, and logging.getLogger takes the
+# logging module lock on every call. Logger objects live for the whole process.
+@lru_cache(maxsize=128)
 def get_logger(name="Default"):
     """Get a logger instance with the specified name."""
     return logging.getLogger(name)